@@ -1,13 +1,17 @@
-import paho.mqtt.client as mqtt
-import mysql.connector
 import json
 import os
+import queue
 import logging
-import time
 import signal
 import sys
+import time
+from collections import namedtuple
 from datetime import datetime
-from health_check import start_health_server
+from brokers import create_brokers
+from health_check import start_health_server, register_status_provider, register_mqtt_check, register_db_check
+from segment_export import create_segment_writer
+from storage import create_storage, ScanRecord, ScanEntry, ErrorRecord, Heartbeat, NewReader
+from write_batcher import WriteBatcher, create_batch_controller
 
 # Setup logging
 logging.basicConfig(
@@ -17,12 +21,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Global variables
-db = None
-cursor = None
-client = None
+storage = None
+brokers = []
+inbox = None
 running = True
-db2 = None
-cursor2 = None
+state = 'starting'
+segment_writer = None
+db_batcher = None
+db2_batcher = None
+enrich_batch_size = 100
+
+# A validated scan message waiting for reader/card enrichment
+ParsedScan = namedtuple('ParsedScan', ['raw_data', 'topic', 'reader_id', 'tag_num', 'tag_ids', 'scan_time'])
+# A scan queued for the first database, with what to do once it is stored
+PendingScan = namedtuple('PendingScan', ['record', 'entry', 'export', 'topic'])
 
 def read_init_file(section):
     """Read configuration from database.init file"""
@@ -50,126 +62,44 @@ def read_init_file(section):
         return {}
 
 def signal_handler(signum, frame):
-    """Handle shutdown signals gracefully"""
+    """Ask the main loop to stop; the actual drain happens in shutdown()"""
     global running
-    logger.info("Received shutdown signal. Cleaning up...")
+    if not running:
+        logger.warning("Received second shutdown signal. Exiting without draining.")
+        sys.exit(1)
+    logger.info("Received shutdown signal. Draining...")
     running = False
-    if client:
-        client.disconnect()
-    if db:
-        db.close()
-    if db2:
-        db2.close()
-    sys.exit(0)
-
-# Register signal handlers
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
-
-# Database connection with retry logic
+
 def connect_to_db():
-    global db, cursor, db2, cursor2
-    retry_count = 0
-    max_retries = 5
-    
+    """Create the configured storage backend and connect to both databases"""
+    global storage
+
     # Load configuration based on environment
     env = 'docker' if os.getenv('DOCKER_ENV') else 'local'
     logger.info(f"Running in {env} environment")
     config = read_init_file(env)
-    
-    # Connect to first database
-    while retry_count < max_retries and running:
-        try:
-            db = mysql.connector.connect(
-                host=config.get('DB_HOST', 'localhost'),
-                port=int(os.getenv("DB_PORT", "3306")),  # ✅ Cast port to int
-                user=config.get('DB_USER', 'rfid'),
-                password=config.get('DB_PASSWORD', 'rfidpass'),
-                database=config.get('DB_NAME', 'rfid_db')
-            )
-            cursor = db.cursor()
-            logger.info("Successfully connected to the first database.")
-            break
-        except mysql.connector.Error as err:
-            retry_count += 1
-            logger.error("Database connection failed (attempt %d): %s", retry_count, err)
-            if retry_count < max_retries:
-                time.sleep(5)
-            else:
-                logger.error("Failed to connect to database after maximum retries")
-                return False
-    
-    # Connect to second database
-    retry_count = 0
-    while retry_count < max_retries and running:
-        try:
-            db2 = mysql.connector.connect(
-                host=config.get('DB_HOST2', 'localhost'),
-                port=int(os.getenv("DB_PORT2", "3306")),  # ✅ Cast port to int
-                user=config.get('DB_USER2', 'rfid'),
-                password=config.get('DB_PASSWORD2', 'rfidpass'),
-                database=config.get('DB_NAME2', 'rfid_db2')
-            )
-            cursor2 = db2.cursor()
-            logger.info("Successfully connected to the second database.")
-            return True
-        except mysql.connector.Error as err:
-            retry_count += 1
-            logger.error("Database2 connection failed (attempt %d): %s", retry_count, err)
-            if retry_count < max_retries:
-                time.sleep(5)
-            else:
-                logger.error("Failed to connect to database2 after maximum retries")
-                return False
 
-def ensure_db_connection():
-    """Check if the database connections are alive, and reconnect if necessary"""
-    global db, cursor, db2, cursor2
+    if storage is None:
+        storage = create_storage(config, should_stop=lambda: not running)
+        register_db_check(storage.is_healthy)
+    return storage.ensure_connection()
+
+def ensure_db_connection(secondary=False):
+    """Check if the first (or, with secondary=True, the second) database connection
+    is alive, and reconnect if necessary"""
+    if storage is None:
+        return connect_to_db()
 
     try:
-        # Check if first database connection is established
-        if db is None or cursor is None:
-            logger.warning("First database connection not established, connecting...")
-            return connect_to_db()
-        
-        # Check if second database connection is established
-        if db2 is None or cursor2 is None:
-            logger.warning("Second database connection not established, connecting...")
-            return connect_to_db()
-        
-        # Check if both connections are alive by executing simple queries
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
-        
-        cursor2.execute("SELECT 1")
-        cursor2.fetchone()
-        
-        return True
-    except mysql.connector.Error as err:
-        logger.warning(f"Database connection lost: {err}. Reconnecting...")
-        try:
-            # Close existing connections if they exist
-            if db:
-                try:
-                    db.close()
-                except:
-                    pass
-            if db2:
-                try:
-                    db2.close()
-                except:
-                    pass
-            
-            # Reconnect
-            return connect_to_db()
-        except Exception as e:
-            logger.error(f"Failed to reconnect to databases: {e}")
-            return False
+        return storage.ensure_connection(secondary)
+    except Exception as e:
+        logger.error(f"Failed to reconnect to databases: {e}")
+        return False
         
 def log_error(error_type, error_message, raw_data=None, source_topic=None, stack_trace=None, tenant_id=None):
-    """Log errors to the error_logs table, ensuring all data is saved"""
-    if not ensure_db_connection():
-        logger.error("Cannot log error - database not connected")
+    """Queue errors for the error_logs table, ensuring all data is saved"""
+    if db_batcher is None:
+        logger.error("Cannot log error - database writer not running")
         # Log to stdout as backup
         logger.error(f"Error details that couldn't be logged to DB:")
         logger.error(f"Type: {error_type}")
@@ -219,20 +149,17 @@ def log_error(error_type, error_message, raw_data=None, source_topic=None, stack
             
         detailed_message_json = json.dumps(detailed_message)
         
-        cursor.execute("""
-            INSERT INTO error_logs 
-            (tenant_id, error_type, error_message, raw_data, source_topic, stack_trace, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, NOW())
-        """, (
-            tenant_id_value, 
-            error_type, 
-            error_message, 
-            json_data, 
-            source_topic,
-            stack_trace
+        db_batcher.submit(ErrorRecord(
+            tenant_id=tenant_id_value,
+            error_type=error_type,
+            error_message=error_message,
+            raw_data=json_data,
+            source_topic=source_topic,
+            stack_trace=stack_trace,
+            created_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         ))
         
-        logger.info(f"📝 Logged message - Type: {error_type}, Message: {error_message}")
+        logger.info(f"📝 Queued message - Type: {error_type}, Message: {error_message}")
         
     except Exception as e:
         logger.error(f"Failed to log to database: {e}")
@@ -246,6 +173,17 @@ def log_error(error_type, error_message, raw_data=None, source_topic=None, stack
         logger.error(f"Tenant ID: {tenant_id}")
         logger.error(f"Database error: {str(e)}")
 
+def log_unwritten_error(record, err):
+    """Dump an error_logs row that could not be written to stdout"""
+    logger.error("Error details that failed to log to DB:")
+    logger.error(f"Type: {record.error_type}")
+    logger.error(f"Message: {record.error_message}")
+    logger.error(f"Raw data: {record.raw_data}")
+    logger.error(f"Source topic: {record.source_topic}")
+    logger.error(f"Stack trace: {record.stack_trace}")
+    logger.error(f"Tenant ID: {record.tenant_id}")
+    logger.error(f"Database error: {str(err)}")
+
 def validate_binimise_format(data):
     """Strictly validate the binimise RFID data format"""
     required_fields = ['deviceSn', 'deviceID', 'tagNum', 'tagID']
@@ -289,25 +227,6 @@ def validate_binimise_format(data):
     
     return True, "Valid format"
 
-def get_tenant_for_card(card_uid):
-    """Get the tenant_id for a given card_uid"""
-    if not ensure_db_connection():
-        logger.error("Cannot determine tenant - database not connected")
-        return None
-    
-    try:
-        cursor.execute(
-            "SELECT tenant_id FROM rfid_cards WHERE card_uid = %s", 
-            (card_uid,)
-        )
-        result = cursor.fetchone()
-        if result:
-            return result[0]
-        return None
-    except Exception as e:
-        logger.error(f"Error getting tenant for card {card_uid}: {e}")
-        return None
-
 def get_tenant_for_reader(reader_id):
     """Get the tenant_id for a given reader_id"""
     if not ensure_db_connection():
@@ -315,38 +234,149 @@ def get_tenant_for_reader(reader_id):
         return None
     
     try:
-        cursor.execute(
-            "SELECT tenant_id, group_id FROM rfid_readers WHERE reader_id = %s", 
-            (reader_id,)
-        )
-        result = cursor.fetchone()
-        if result:
-            return result[0], result[1]  # Return both tenant_id and group_id
+        reader = storage.resolve_readers([reader_id]).get(reader_id)
+        if reader:
+            return reader.tenant_id, reader.group_id  # Return both tenant_id and group_id
         return None, None
     except Exception as e:
         logger.error(f"Error getting tenant, group for reader {reader_id}: {e}")
         return None, None
 
-def save_successful_scan_to_db2(device_id, tag_id, tenant_id, group_id, scan_time):
-    """Save successfully decoded message to second database"""
+def save_successful_scan_to_db2(entry):
+    """Queue a successfully stored scan for the second database.
+
+    Runs on the first database's writer thread, so it never waits: when the
+    second database has fallen behind far enough to fill its queue, the
+    entry is dropped (and counted) rather than stalling rfid_logs writes.
+    """
+    if not db2_batcher.submit(entry, block=False):
+        logger.error(f"Second database queue full - dropped scan of tag {entry.tag_id} at reader {entry.device_id}")
+
+def write_rows(write, rows):
+    """Run one storage write, returning its rejected (row, error) pairs"""
+    if not rows:
+        return []
+    try:
+        return write(rows)
+    except Exception as e:
+        return [(row, e) for row in rows]
+
+def write_db_batch(items):
+    """Write a batch of queued rows to the first database, returning what each write rejected.
+
+    Only the writes happen here, so the batcher's commit latency measures
+    the database alone; finish_db_batch does the follow-up work.
+    """
     if not ensure_db_connection():
-        logger.error("Cannot save to second database - connection not available")
-        return False
-    
+        raise RuntimeError("database not connected")
+
+    return (
+        write_rows(storage.write_scans, [i.record for i in items if isinstance(i, PendingScan)]),
+        write_rows(storage.write_errors, [i for i in items if isinstance(i, ErrorRecord)]),
+        write_rows(storage.update_liveness, [i for i in items if isinstance(i, Heartbeat)]),
+    )
+
+def finish_db_batch(items, rejected):
+    """Forward stored scans and report rejected rows of a written batch, returning how many failed"""
+    rejected_scans, rejected_errors, rejected_heartbeats = rejected
+    pending = [i for i in items if isinstance(i, PendingScan)]
+    failed = 0
+
+    if pending:
+        # Only scans the database rejected are reported; the rest are stored
+        rejected_scans = {id(record): err for record, err in rejected_scans}
+        stored = len(pending) - len(rejected_scans)
+        if stored:
+            logger.info(f"💾 Saved {stored} scans to DB")
+        for p in pending:
+            err = rejected_scans.get(id(p.record))
+            if err is None:
+                save_successful_scan_to_db2(p.entry)
+                export_scan(**p.export)
+                continue
+            failed += 1
+            # Log database errors for each card
+            log_error(
+                ERROR_DATABASE,
+                f"Failed to save scan for card {p.record.card_uid}: {str(err)}",
+                p.record.raw_data,
+                p.topic,
+                tenant_id=p.record.tenant_id
+            )
+
+    if rejected_errors:
+        failed += len(rejected_errors)
+        logger.error(f"Failed to log {len(rejected_errors)} errors to database")
+        for record, err in rejected_errors:
+            log_unwritten_error(record, err)
+
+    for heartbeat, err in rejected_heartbeats:
+        failed += 1
+        log_error(ERROR_DATABASE, f"Failed to update reader heartbeat for {heartbeat.reader_id}: {str(err)}")
+
+    return failed
+
+def write_db2_batch(items):
+    """Write a batch of queued scan entries to the second database"""
+    if not ensure_db_connection(secondary=True):
+        raise RuntimeError("second database not connected")
+    rejected = storage.write_scan_entries(items)
+    for entry, err in rejected:
+        logger.error(f"Second database rejected scan of tag {entry.tag_id} at reader {entry.device_id}: {err}")
+    logger.info(f"💾 Saved {len(items) - len(rejected)} successful scans to DB2")
+    return len(rejected)
+
+def handle_failed_db_batch(items, err):
+    """Report rows dropped because the first database was unavailable"""
+    for item in items:
+        if isinstance(item, ErrorRecord):
+            log_unwritten_error(item, err)
+        elif isinstance(item, PendingScan):
+            logger.error(f"Dropped scan for card {item.record.card_uid} at reader {item.record.reader_id}: {err}")
+
+def handle_failed_db2_batch(items, err):
+    """Report rows dropped because the second database was unavailable"""
+    logger.error(f"Failed to save {len(items)} scans to second database: {err}")
+
+def start_write_batchers(config):
+    """Start the batched writers for both databases"""
+    global db_batcher, db2_batcher
+    max_queue = int(config.get('BATCH_MAX_QUEUE', 10000))
+    db_batcher = WriteBatcher('db', write_db_batch, create_batch_controller(config),
+                              handle_failed_db_batch, max_queue, after_write=finish_db_batch)
+    db2_batcher = WriteBatcher('db2', write_db2_batch, create_batch_controller(config),
+                               handle_failed_db2_batch, max_queue)
+    db_batcher.start()
+    db2_batcher.start()
+    register_status_provider('batching', lambda: {
+        'db': db_batcher.snapshot(),
+        'db2': db2_batcher.snapshot()
+    })
+
+def stop_write_batchers(deadline):
+    """Flush queued rows; the first database feeds the second, so it goes first"""
+    for batcher in (db_batcher, db2_batcher):
+        if batcher:
+            batcher.stop(max(1, deadline - time.monotonic()))
+
+def export_scan(scan_time, tenant_id, group_id, reader_id, card_uid, is_authorized, card_type, owner_name, topic):
+    """Append a stored scan to the columnar segment export, if enabled"""
+    if not segment_writer:
+        return
     try:
-        cursor2.execute("""
-            INSERT INTO rfid_scan_entry 
-            (rfid_device_unique_id, rfid_tag_unique_id, tenant_id, group_id, scan_time)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (device_id, tag_id, tenant_id, group_id, scan_time))
-        
-        db2.commit()
-        logger.info(f"💾 Saved successful scan to DB2: device={device_id}, tag={tag_id}, tenant={tenant_id}, group={group_id}")
-        return True
-        
+        segment_writer.append({
+            'scan_time': scan_time,
+            'tenant_id': tenant_id,
+            'group_id': group_id,
+            'reader_id': reader_id,
+            'card_uid': card_uid,
+            'is_authorized': bool(is_authorized),
+            'card_type': card_type,
+            'owner_name': owner_name,
+            'source_topic': topic
+        })
     except Exception as e:
-        logger.error(f"Failed to save scan to second database: {e}")
-        return False
+        logger.error(f"Failed to export scan for card {card_uid}: {e}")
 
 # Error type constants
 ERROR_MQTT_PARSE = 'mqtt_parse_error'
@@ -358,337 +388,352 @@ ERROR_GENERAL = 'general_error'
 ERROR_SYSTEM = 'system_error'
 ERROR_PARSE = 'parse_error'
 
-def process_rfid_scan(payload, topic):
-    """Process RFID scan data and insert into database"""
-    if not ensure_db_connection():
-        log_error(ERROR_DATABASE, "Cannot process RFID scan - database not connected", 
-                 payload.decode(), topic)
-        return
-        
-    # First, save the raw data
+def parse_rfid_scan(payload, topic):
+    """Parse and validate one scan message; returns a ParsedScan, or None after logging why not"""
     raw_data = payload.decode()
     logger.info(f"📨 Received message on {topic}: {raw_data}")
-    
+
+    # Try to parse JSON payload
     try:
-        # Try to parse JSON payload
-        try:
-            data = json.loads(raw_data)
-        except json.JSONDecodeError as e:
-            # Log invalid JSON to error_logs and stop processing
-            log_error(ERROR_PARSE, f"Invalid JSON: {str(e)}", raw_data, topic)
-            return
-
-        # Look for alternate field names and log as error if found
-        if 'devicelater' in data:
-            log_error(
-                ERROR_VALIDATION,
-                "Found 'devicelater' instead of required 'deviceID'",
-                raw_data,
-                topic,
-                tenant_id=1
-            )
-            return
+        data = json.loads(raw_data)
+    except json.JSONDecodeError as e:
+        # Log invalid JSON to error_logs and stop processing
+        log_error(ERROR_PARSE, f"Invalid JSON: {str(e)}", raw_data, topic)
+        return None
 
-        # Strictly validate the format
-        is_valid, validation_message = validate_binimise_format(data)
-        if not is_valid:
-            # Log validation error and stop processing
-            log_error(
-                ERROR_VALIDATION,
-                f"Invalid format: {validation_message}",
-                raw_data,
-                topic,
-                tenant_id=1
-            )
-            return
+    # Look for alternate field names and log as error if found
+    if 'devicelater' in data:
+        log_error(
+            ERROR_VALIDATION,
+            "Found 'devicelater' instead of required 'deviceID'",
+            raw_data,
+            topic,
+            tenant_id=1
+        )
+        return None
 
-        # At this point, we have valid data with all required fields
-        reader_id = data['deviceID']
-        device_sn = data['deviceSn']
-        tag_num = data['tagNum']
-        scan_time = datetime.now()
+    # Strictly validate the format
+    is_valid, validation_message = validate_binimise_format(data)
+    if not is_valid:
+        # Log validation error and stop processing
+        log_error(
+            ERROR_VALIDATION,
+            f"Invalid format: {validation_message}",
+            raw_data,
+            topic,
+            tenant_id=1
+        )
+        return None
 
+    # At this point, we have valid data with all required fields
+    return ParsedScan(
+        raw_data=raw_data,
+        topic=topic,
+        reader_id=data['deviceID'],
+        tag_num=data['tagNum'],
         # Parse multiple tag IDs from the comma-separated string
-        tag_ids = [tag.strip() for tag in data['tagID'].split(',') if tag.strip()]
-        
-        logger.info(f"📊 Processing {tag_num} tags: {tag_ids}")
-
-        # Get reader information
-        cursor.execute("""
-            SELECT r.tenant_id, r.id, r.name, r.location, r.group_id
-            FROM rfid_readers r 
-            WHERE r.reader_id = %s
-        """, (reader_id,))
-        reader_info = cursor.fetchone()
-
-        if not reader_info:
-            # Log unknown reader to error_logs and stop processing
-            log_error(
-                ERROR_UNKNOWN_READER,
-                f"Reader not found in database: {reader_id}",
-                raw_data,
-                topic,
-                tenant_id=1
-            )
-            return
-
-        tenant_id = reader_info[0]
-        group_id = reader_info[4] if reader_info[4] is not None else 1  # Default to group 1 if null
-
-        # Process each tag individually
-        processed_tags = 0
-        for card_uid in tag_ids:
-            try:
-                # Get card information
-                cursor.execute("""
-                    SELECT c.is_active, c.tenant_id, 
-                           COALESCE(s.first_name, v.owner_name) as owner_name,
-                           CASE 
-                             WHEN s.id IS NOT NULL THEN 'staff'
-                             WHEN v.id IS NOT NULL THEN 'vehicle'
-                             ELSE c.card_type
-                           END as type
-                    FROM rfid_cards c
-                    LEFT JOIN staff s ON c.staff_id = s.id
-                    LEFT JOIN vehicles v ON c.vehicle_id = v.id
-                    WHERE c.card_uid = %s
-                """, (card_uid,))
-                card_result = cursor.fetchone()
-
-                if not card_result:
-                    # Log unknown card to error_logs
-                    log_error(
-                        ERROR_UNKNOWN_CARD,
-                        f"Card not found in database: {card_uid}",
-                        raw_data,
-                        topic,
-                        tenant_id=tenant_id
-                    )
-                    is_authorized = False
-                    card_type = 'unknown'
-                    owner_name = None
-                else:
-                    is_authorized = card_result[0]
-                    card_type = card_result[3]
-                    owner_name = card_result[2]
-
-                # Insert the validated scan into rfid_logs
-                cursor.execute("""
-                    INSERT INTO rfid_logs (
-                        card_uid, reader_id, is_authorized, timestamp, tenant_id, 
-                        event_type, raw_data, notes
-                    ) VALUES (%s, %s, %s, %s, %s, 'scan', %s, %s)
-                """, (
-                    card_uid, 
-                    reader_id, 
-                    is_authorized,
-                    scan_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    tenant_id,
-                    raw_data,
-                    f"Card Type: {card_type}, Owner: {owner_name if owner_name else 'Unknown'}, Batch scan: {processed_tags + 1}/{tag_num}"
-                ))
-                
-                # Commit first database transaction
-                db.commit()
-                
-                # Save successful scan to second database
-                save_successful_scan_to_db2(
-                    device_id=reader_id,
-                    tag_id=card_uid,
-                    tenant_id=tenant_id,
-                    group_id=group_id,
-                    scan_time=scan_time.strftime('%Y-%m-%d %H:%M:%S')
-                )
-                
-                processed_tags += 1
-                logger.info(f"✅ Successfully logged scan {processed_tags}/{tag_num} for card {card_uid} at reader {reader_id}")
+        tag_ids=[tag.strip() for tag in data['tagID'].split(',') if tag.strip()],
+        scan_time=datetime.now()
+    )
+
+def process_rfid_scans(messages):
+    """Process a micro-batch of (payload, topic) scan messages and queue them for the database.
+
+    Readers and cards of every message in the batch are resolved with one
+    set-based lookup each instead of one query per tag.
+    """
+    if not ensure_db_connection():
+        for payload, topic in messages:
+            log_error(ERROR_DATABASE, "Cannot process RFID scan - database not connected",
+                      payload.decode(), topic)
+        return
+
+    scans = []
+    for payload, topic in messages:
+        try:
+            scan = parse_rfid_scan(payload, topic)
+        except Exception as e:
+            log_error(ERROR_SYSTEM, f"Unexpected error: {str(e)}", payload.decode(), topic, stack_trace=str(e))
+            continue
+        if scan:
+            scans.append(scan)
+    if not scans:
+        return
+
+    try:
+        readers = storage.resolve_readers(scan.reader_id for scan in scans)
+        cards = storage.resolve_cards(
+            card_uid for scan in scans if scan.reader_id in readers for card_uid in scan.tag_ids
+        )
+    except Exception as e:
+        for scan in scans:
+            log_error(ERROR_DATABASE, f"Failed to look up readers and cards: {str(e)}", scan.raw_data, scan.topic)
+        return
 
-            except Exception as e:
-                # Log database errors for this specific card but continue with others
+    logger.info(f"🔎 Resolved {len(readers)} readers and {len(cards)} cards for {len(scans)} messages")
+    for scan in scans:
+        try:
+            queue_enriched_scan(scan, readers.get(scan.reader_id), cards)
+        except Exception as e:
+            # Log any unexpected errors
+            log_error(ERROR_SYSTEM, f"Unexpected error: {str(e)}", scan.raw_data, scan.topic, stack_trace=str(e))
+
+def queue_enriched_scan(scan, reader_info, cards):
+    """Queue one message's tags for rfid_logs using already resolved reader and card info"""
+    raw_data, topic, reader_id = scan.raw_data, scan.topic, scan.reader_id
+    tag_num, scan_time = scan.tag_num, scan.scan_time
+    logger.info(f"📊 Processing {tag_num} tags: {scan.tag_ids}")
+
+    if not reader_info:
+        # Log unknown reader to error_logs and stop processing
+        log_error(
+            ERROR_UNKNOWN_READER,
+            f"Reader not found in database: {reader_id}",
+            raw_data,
+            topic,
+            tenant_id=1
+        )
+        return
+
+    tenant_id = reader_info.tenant_id
+    group_id = reader_info.group_id if reader_info.group_id is not None else 1  # Default to group 1 if null
+    unknown_cards = set(scan.tag_ids).difference(cards)
+
+    processed_tags = 0
+    for card_uid in scan.tag_ids:
+        try:
+            if card_uid in unknown_cards:
+                # Log unknown card to error_logs
                 log_error(
-                    ERROR_DATABASE,
-                    f"Failed to save scan for card {card_uid}: {str(e)}",
+                    ERROR_UNKNOWN_CARD,
+                    f"Card not found in database: {card_uid}",
                     raw_data,
                     topic,
                     tenant_id=tenant_id
                 )
-                continue
+                is_authorized = False
+                card_type = 'unknown'
+                owner_name = None
+            else:
+                card_result = cards[card_uid]
+                is_authorized = card_result.is_active
+                card_type = card_result.card_type
+                owner_name = card_result.owner_name
+
+            # Queue the validated scan for rfid_logs; DB2 and the segment export follow once it is stored
+            db_batcher.submit(PendingScan(
+                record=ScanRecord(
+                    card_uid=card_uid,
+                    reader_id=reader_id,
+                    is_authorized=is_authorized,
+                    timestamp=scan_time.strftime('%Y-%m-%d %H:%M:%S'),
+                    tenant_id=tenant_id,
+                    raw_data=raw_data,
+                    notes=f"Card Type: {card_type}, Owner: {owner_name if owner_name else 'Unknown'}, Batch scan: {processed_tags + 1}/{tag_num}"
+                ),
+                entry=ScanEntry(
+                    device_id=reader_id,
+                    tag_id=card_uid,
+                    tenant_id=tenant_id,
+                    group_id=group_id,
+                    scan_time=scan_time.strftime('%Y-%m-%d %H:%M:%S')
+                ),
+                export=dict(
+                    scan_time=scan_time, tenant_id=tenant_id, group_id=group_id,
+                    reader_id=reader_id, card_uid=card_uid, is_authorized=is_authorized,
+                    card_type=card_type, owner_name=owner_name, topic=topic
+                ),
+                topic=topic
+            ))
+
+            processed_tags += 1
+            logger.info(f"✅ Queued scan {processed_tags}/{tag_num} for card {card_uid} at reader {reader_id}")
 
-        # Update reader heartbeat once after processing all tags
-        try:
-            cursor.execute("""
-                UPDATE rfid_readers 
-                SET last_heartbeat = %s, is_online = TRUE
-                WHERE reader_id = %s
-            """, (scan_time, reader_id))
-            
-            logger.info(f"💓 Updated reader {reader_id} heartbeat after processing {processed_tags}/{tag_num} tags")
-            
         except Exception as e:
+            # Log errors for this specific card but continue with others
             log_error(
                 ERROR_DATABASE,
-                f"Failed to update reader heartbeat: {str(e)}",
+                f"Failed to save scan for card {card_uid}: {str(e)}",
                 raw_data,
                 topic,
                 tenant_id=tenant_id
             )
+            continue
 
-    except Exception as e:
-        # Log any unexpected errors
-        log_error(
-            ERROR_SYSTEM,
-            f"Unexpected error: {str(e)}",
-            raw_data,
-            topic,
-            stack_trace=str(e)
-        )
+    # Update reader heartbeat once after processing all tags
+    db_batcher.submit(Heartbeat(reader_id, scan_time))
+    logger.info(f"💓 Queued reader {reader_id} heartbeat after processing {processed_tags}/{tag_num} tags")
 
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        logger.info("Connected to MQTT broker")
-        # Subscribe to the correct binimise RFID topic
-        client.subscribe("binimise/rfid/RunData")
-        # Keep legacy topics for backward compatibility
-        client.subscribe("rfid/scan")
-        client.subscribe("rfid/+/scan")  # Subscribe to reader-specific topics
-        client.subscribe("rfid/heartbeat")
-        logger.info("Subscribed to MQTT topics: binimise/rfid/RunData, rfid/scan, rfid/+/scan, rfid/heartbeat")
-    else:
-        logger.error(f"Failed to connect to MQTT broker: {rc}")
-
-def on_message(client, userdata, msg):
-    logger.info(f"📨 Received message on {msg.topic}: {msg.payload}")
+def handle_message(message):
+    """Handle one non-scan message; scans are enriched in batches by handle_messages"""
+    logger.info(f"📨 Received message from {message.broker} on {message.topic}: {message.payload}")
     
     if not ensure_db_connection():
         logger.error("Database not connected - skipping message")
         return
     
     try:
-        if msg.topic == "binimise/rfid/RunData":
-            # Handle binimise RFID RunData format
-            process_rfid_scan(msg.payload, msg.topic)
-        elif msg.topic.startswith("rfid/") and msg.topic.endswith("/scan"):
-            process_rfid_scan(msg.payload, msg.topic)
-        elif msg.topic == "rfid/scan":
-            process_rfid_scan(msg.payload, msg.topic)
-        elif msg.topic == "rfid/heartbeat":
+        if message.kind == "heartbeat":
             # Handle reader heartbeat
-            data = json.loads(msg.payload.decode())
+            data = json.loads(message.payload.decode())
             reader_id = data.get('reader_id')
             if reader_id:
                 # Try to determine the tenant_id and group_id for this reader
                 tenant_id, group_id = get_tenant_for_reader(reader_id)
                 
-                cursor.execute("""
-                    UPDATE rfid_readers 
-                    SET last_heartbeat = NOW(), status = 'online' 
-                    WHERE id = %s
-                """, (reader_id,))
-                
-                # If reader doesn't exist, create it with the appropriate tenant_id
-                if cursor.rowcount == 0:
+                # If reader doesn't exist, create it with the default tenant
+                if tenant_id is None:
                     try:
-                        cursor.execute("""
-                            INSERT INTO rfid_readers (id, name, location, status, tenant_id, reader_group_id)
-                            VALUES (%s, %s, %s, 'online', %s, 1)
-                        """, (reader_id, f"Auto-created {reader_id}", f"Location for {reader_id}", tenant_id))
-                        logger.info(f"Auto-created reader entry for {reader_id} from heartbeat with tenant_id: {tenant_id if tenant_id else 'NULL'}")
+                        rejected = storage.create_readers([NewReader(
+                            reader_id, f"Auto-created {reader_id}", f"Location for {reader_id}", 1
+                        )])
+                        if rejected:
+                            raise rejected[0][1]
+                        logger.info(f"Auto-created reader entry for {reader_id} from heartbeat with tenant_id: 1")
                     except Exception as e:
                         logger.error(f"Could not auto-create reader {reader_id} from heartbeat: {e}")
                 else:
-                    logger.info(f"💓 Updated heartbeat for reader: {reader_id} - Tenant: {tenant_id if tenant_id else 'Unknown'}, Group: {group_id if group_id else 'Unknown'}")
+                    db_batcher.submit(Heartbeat(reader_id, datetime.now()))
+                    logger.info(f"💓 Queued heartbeat for reader: {reader_id} - Tenant: {tenant_id}, Group: {group_id if group_id else 'Unknown'}")
+        else:
+            logger.warning(f"Unknown message kind '{message.kind}' for topic {message.topic}")
     except Exception as e:
         logger.error(f"Error handling message: {e}")
         import traceback
         traceback.print_exc()
 
-def on_disconnect(client, userdata, rc):
-    logger.warning("⚠️ Disconnected from MQTT broker")
-    if rc != 0:
-        logger.error("Unexpected disconnection. Attempting to reconnect...")
+def handle_messages(messages):
+    """Handle a micro-batch of messages in order, enriching consecutive scans together"""
+    scans = []
+    for message in messages:
+        if message.kind == "scan":
+            scans.append((message.payload, message.topic))
+            continue
+        if scans:
+            process_rfid_scans(scans)
+            scans = []
+        handle_message(message)
+    if scans:
+        process_rfid_scans(scans)
+
+def take_messages(first=None):
+    """Collect up to enrich_batch_size messages that are already waiting in the inbox"""
+    messages = [first] if first is not None else []
+    while len(messages) < enrich_batch_size:
+        try:
+            messages.append(inbox.get_nowait())
+        except queue.Empty:
+            break
+    return messages
+
+def start_brokers(config):
+    """Connect to every configured MQTT broker, all feeding one shared inbox"""
+    global brokers, inbox
+    inbox = queue.Queue(maxsize=int(config.get('MQTT_INBOX_SIZE', 10000)))
+    brokers = create_brokers(config, inbox, read_init_file)
+    for broker in brokers:
+        broker.start()
+    register_mqtt_check(lambda: any(b.is_connected() for b in brokers))
+    register_status_provider('brokers', lambda: {
+        'inbox_depth': inbox.qsize(),
+        **{b.name: b.snapshot() for b in brokers}
+    })
+
+def process_messages():
+    """Run the shared processing pipeline until shutdown"""
+    logger.info(f"🚀 Processing messages from {len(brokers)} MQTT broker(s)...")
+    while running:
+        try:
+            message = inbox.get(timeout=1)
+        except queue.Empty:
+            continue
+        handle_messages(take_messages(message))
+
+def drain_inbox(deadline):
+    """Process messages already taken off the brokers, until empty or the deadline"""
+    processed = 0
+    while time.monotonic() < deadline:
+        messages = take_messages()
+        if not messages:
+            break
+        handle_messages(messages)
+        processed += len(messages)
+    return processed
+
+def shutdown(timeout):
+    """Stop consuming, finish queued work and flush pending writes within timeout seconds"""
+    global state
+    state = 'draining'
+    deadline = time.monotonic() + timeout
+
+    # Stop consuming first so nothing new arrives while draining. Messages
+    # published meanwhile stay in the brokers' persistent sessions.
+    # Network threads still stalled on a full inbox at the deadline give up
+    # without acknowledging, so their messages are redelivered.
+    for broker in brokers:
+        try:
+            broker.disconnect(deadline)
+        except Exception as e:
+            logger.error(f"Error disconnecting from broker {broker.name}: {e}")
+
+    processed = drain_inbox(deadline) if inbox else 0
+    for broker in brokers:
+        # Allow one more put attempt past the deadline for the thread to notice it
+        broker.stop(max(0, deadline - time.monotonic()) + 2 * broker.put_timeout)
+    # A network thread blocked on a full inbox may have added one more message
+    if inbox:
+        processed += drain_inbox(deadline)
+        if inbox.qsize():
+            logger.error(f"Shutdown deadline reached with {inbox.qsize()} messages unprocessed")
+    logger.info(f"Drained {processed} queued messages")
+
+    stop_write_batchers(deadline)
+    if segment_writer:
+        segment_writer.close()
+    if storage:
+        storage.close()
+    state = 'stopped'
+    logger.info("Shutdown complete")
 
 def main():
-    """Main function to run the MQTT client"""
-    global client, running
-    
+    """Run the subscriber: start up, process messages until signalled, then drain"""
+    global segment_writer, state, enrich_batch_size
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    env = 'docker' if os.getenv('DOCKER_ENV') else 'local'
+    config = read_init_file(env)
+    shutdown_timeout = float(config.get('SHUTDOWN_TIMEOUT', 25))
+    enrich_batch_size = int(config.get('ENRICH_BATCH_SIZE', 100))
+
     # Start health check server
-    start_health_server(port=8081)
-    
+    start_health_server(port=int(os.getenv("HEALTH_PORT", "8080")))
+    register_status_provider('lifecycle', lambda: {'state': state})
+
     # Initialize database connection
     if not connect_to_db():
+        if not running:
+            logger.info("Shutdown requested while connecting to the database")
+            return 0
         logger.error("Cannot start without database connection")
-        return
-    
-    # MQTT Client setup
-    client = mqtt.Client()
-    client.on_connect = on_connect
-    client.on_message = on_message
-    client.on_disconnect = on_disconnect
-    
-    # Connect to MQTT broker with retry logic
-    env = 'docker' if os.getenv('DOCKER_ENV') else 'local'
-    config = read_init_file(env)
-    broker_host = config.get("MQTT_BROKER", "localhost")
-    broker_port = int(os.getenv("MQTT_PORT", "1883"))
-    
-    retry_count = 0
-    max_retries = 5
-    
-    while retry_count < max_retries and running:
-        try:
-            logger.info(f"🔄 Attempting to connect to MQTT broker at {broker_host}:{broker_port}")
-            client.connect(broker_host, broker_port, 60)
-            break
-        except Exception as e:
-            retry_count += 1
-            logger.error(f"Failed to connect to MQTT broker (attempt {retry_count}): {e}")
-            if retry_count < max_retries:
-                time.sleep(5)
-    
-    if retry_count >= max_retries:
-        logger.error("Failed to connect to MQTT broker after maximum retries")
-        return
-    
-    # Start the loop
-    logger.info("🚀 Starting MQTT client loop...")
+        return 1
+
+    exit_code = 0
     try:
-        client.loop_forever()
-    except KeyboardInterrupt:
-        logger.info("Received keyboard interrupt")
+        segment_writer = create_segment_writer(config)
+        start_write_batchers(config)
+        # A signal during startup skips consuming and goes straight to shutdown
+        if running:
+            start_brokers(config)
+            state = 'running'
+            process_messages()
     except Exception as e:
-        logger.error(f"Error in MQTT loop: {e}")
+        logger.error(f"Fatal error: {e}")
+        exit_code = 1
     finally:
-        if client:
-            client.disconnect()
-        if db:
-            db.close()
-        if db2:
-            db2.close()
+        shutdown(shutdown_timeout)
+    return exit_code
 
 if __name__ == "__main__":
-    try:
-        # Start health check server
-        start_health_server(port=8080)
-        
-        # Connect to database
-        if not connect_to_db():
-            logger.error("Failed to connect to database. Exiting.")
-            sys.exit(1)
-
-        # Setup MQTT client
-        client = mqtt.Client()
-        client.on_connect = on_connect
-        client.on_message = on_message
-
-        # Connect to MQTT broker
-        env = 'docker' if os.getenv('DOCKER_ENV') else 'local'
-        config = read_init_file(env)
-        mqtt_host = config.get("MQTT_BROKER", "localhost")
-        client.connect(mqtt_host, 1883, 60)
-
-        # Start MQTT loop
-        client.loop_forever()
-
-    except Exception as e:
-        logger.error(f"Fatal error: {e}")
-        sys.exit(1)
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Benchmark the subscriber's storage paths against SQLite.
+
+Compares per-row against set-based lookups and writes, and runs the
+adaptive write batcher over the same scans. Use a file path rather than
+':memory:' to include the cost of real commits.
+
+Examples:
+    python benchmark.py
+    python benchmark.py --path /tmp/bench.sqlite --scans 20000 --batch-size 200
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+
+from storage import SQLiteStorage, ScanRecord
+from write_batcher import WriteBatcher, AdaptiveBatchController
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def seed(storage, cards):
+    storage.db.execute("INSERT INTO rfid_readers (tenant_id, reader_group_id, reader_id, name) VALUES (1, 1, 'R1', 'Gate')")
+    storage.db.executemany(
+        "INSERT INTO rfid_cards (tenant_id, card_uid, card_type) VALUES (1, ?, 'visitor')",
+        [(f"CARD{i:06d}",) for i in range(cards)]
+    )
+    storage.db.commit()
+
+
+def make_scans(count, cards):
+    return [
+        ScanRecord(f"CARD{i % cards:06d}", 'R1', True, '2025-01-01 08:00:00', 1, '{}', 'benchmark')
+        for i in range(count)
+    ]
+
+
+def timed(label, count, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32}{count:>8} rows {elapsed:>8.3f}s {count / elapsed:>12.0f} rows/s")
+    return elapsed
+
+
+def run_batcher(storage, scans, target_latency):
+    controller = AdaptiveBatchController(target_latency=target_latency)
+    batcher = WriteBatcher('bench', storage.write_scans, controller, after_write=lambda items, rejected: len(rejected))
+    batcher.start()
+    for record in scans:
+        batcher.submit(record)
+    batcher.stop()
+    return batcher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark SQLite storage and write batching")
+    parser.add_argument('--path', default=':memory:', help="SQLite database file")
+    parser.add_argument('--scans', type=int, default=10000, help="Number of scans to write")
+    parser.add_argument('--cards', type=int, default=5000, help="Number of known cards")
+    parser.add_argument('--batch-size', type=int, default=200, help="Rows per fixed-size batch")
+    parser.add_argument('--target-latency-ms', type=float, default=500, help="Batcher latency target")
+    args = parser.parse_args(argv)
+
+    if args.path != ':memory:' and os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+
+    storage = SQLiteStorage(args.path)
+    if not storage.connect():
+        return 1
+    try:
+        seed(storage, args.cards)
+        scans = make_scans(args.scans, args.cards)
+        uids = [s.card_uid for s in scans]
+
+        timed("lookup per card", len(uids), lambda: [storage.resolve_cards([uid]) for uid in uids])
+        timed("lookup as one set", len(uids), lambda: storage.resolve_cards(uids))
+
+        timed("write per row", len(scans), lambda: [storage.write_scans([s]) for s in scans])
+        timed(f"write in batches of {args.batch_size}", len(scans), lambda: [
+            storage.write_scans(scans[i:i + args.batch_size]) for i in range(0, len(scans), args.batch_size)
+        ])
+
+        result = {}
+        timed("adaptive write batcher", len(scans),
+              lambda: result.update(batcher=run_batcher(storage, scans, args.target_latency_ms / 1000)))
+        stats = result['batcher'].snapshot()
+        print(f"  batcher: {stats['flushes']} flushes, final batch size {stats['batch_size']}, "
+              f"flush interval {stats['flush_interval_ms']}ms, {stats['rows_failed']} failed")
+    finally:
+        storage.close()
+        if args.path != ':memory:':
+            os.remove(args.path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
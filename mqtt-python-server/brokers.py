@@ -0,0 +1,269 @@
+import os
+import time
+import queue
+import threading
+import logging
+from collections import namedtuple
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+# Topics subscribed when a broker does not configure TOPICS, mapped to the
+# kind of message they carry
+DEFAULT_TOPICS = {
+    "binimise/rfid/RunData": "scan",
+    # Keep legacy topics for backward compatibility
+    "rfid/scan": "scan",
+    "rfid/+/scan": "scan",  # Reader-specific topics
+    "rfid/heartbeat": "heartbeat",
+}
+
+# Message kinds the pipeline knows how to handle
+MESSAGE_KINDS = ('scan', 'heartbeat')
+
+class BrokerStopped(Exception):
+    """Raised in the network thread to abandon a message at the shutdown deadline"""
+
+
+# One message taken off any broker, as handed to the shared pipeline
+InboundMessage = namedtuple('InboundMessage', ['broker', 'topic', 'payload', 'kind'])
+
+
+def parse_topic_map(value):
+    """Parse 'topic:kind,topic:kind' into a dict; a bare topic means 'scan'"""
+    topics = {}
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        topic, _, kind = entry.rpartition(':') if ':' in entry else (entry, '', 'scan')
+        kind = kind.strip() or 'scan'
+        if kind not in MESSAGE_KINDS:
+            raise ValueError(f"Unknown message kind '{kind}' for topic {topic.strip()} "
+                             f"(expected one of: {', '.join(MESSAGE_KINDS)})")
+        topics[topic.strip()] = kind
+    return topics
+
+
+class BrokerConnection:
+    """One MQTT broker feeding the shared message queue.
+
+    The paho network loop runs in its own thread and reconnects with
+    exponential backoff between ``min_backoff`` and ``max_backoff``.
+    With a fixed ``client_id`` the broker keeps a persistent session, so
+    QoS 1 messages published while the subscriber restarts are delivered
+    once it reconnects. paho acknowledges a message only after it has been
+    put on the inbox.
+
+    While the inbox is full the network thread keeps retrying the put every
+    ``put_timeout`` seconds and records the stall. It sends no keepalives
+    meanwhile, so a stall longer than the keepalive makes the broker drop
+    the connection; the unacknowledged message is then redelivered after
+    reconnecting and may be processed twice. Once the shutdown deadline
+    given to ``disconnect`` has passed, the put is abandoned by raising
+    BrokerStopped, so paho sends no PUBACK and the persistent session
+    redelivers the message on the next start.
+    """
+
+    def __init__(self, name, host, port, topics, inbox, username=None, password=None,
+                 client_id='', qos=1, keepalive=60, min_backoff=1, max_backoff=60, put_timeout=0.5):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.topics = topics
+        self.inbox = inbox
+        self.qos = qos
+        self.keepalive = keepalive
+        self.put_timeout = put_timeout
+
+        self.client = mqtt.Client(client_id=client_id, clean_session=not client_id)
+        if username:
+            self.client.username_pw_set(username, password)
+        self.client.reconnect_delay_set(min_delay=min_backoff, max_delay=max_backoff)
+        self.client.on_connect = self.on_connect
+        self.client.on_connect_fail = self.on_connect_fail
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+
+        self.messages = 0
+        self.unmatched = 0
+        self.connects = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.last_message_at = None
+        self.last_error = None
+        self.inbox_stalls = 0
+        self.stalled_seconds = 0.0
+        self.stalled_since = None
+        self.abandoned = 0
+        # time.monotonic() after which a stalled put gives up
+        self.give_up_at = None
+
+    def start(self):
+        logger.info(f"🔄 [{self.name}] Connecting to MQTT broker at {self.host}:{self.port}")
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.client.loop_start()
+
+    def disconnect(self, deadline=None):
+        """Stop consuming; the network thread exits once the disconnect is sent.
+
+        A put still waiting on a full inbox after ``deadline`` (a
+        time.monotonic() value) is abandoned.
+        """
+        self.give_up_at = deadline
+        self.client.disconnect()
+
+    def stop(self, timeout=None):
+        """Disconnect and wait at most timeout seconds for the network thread to exit"""
+        self.client.disconnect()
+        # paho 1.6's loop_stop() joins its thread without a timeout
+        thread = self.client._thread
+        self.client._thread_terminate = True
+        if thread is None or thread is threading.current_thread():
+            return True
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error(f"[{self.name}] Network thread did not stop within {timeout}s")
+            return False
+        self.client._thread = None
+        return True
+
+    def is_connected(self):
+        return self.client.is_connected()
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connects += 1
+            logger.info(f"[{self.name}] Connected to MQTT broker")
+            client.subscribe([(topic, self.qos) for topic in self.topics])
+            logger.info(f"[{self.name}] Subscribed to MQTT topics: {', '.join(self.topics)}")
+        else:
+            self.last_error = mqtt.connack_string(rc)
+            logger.error(f"[{self.name}] Failed to connect to MQTT broker: {self.last_error}")
+
+    def on_connect_fail(self, client, userdata):
+        self.connect_failures += 1
+        self.last_error = "connection failed"
+        logger.error(f"[{self.name}] Could not reach MQTT broker at {self.host}:{self.port}. Retrying with backoff...")
+
+    def on_disconnect(self, client, userdata, rc):
+        self.disconnects += 1
+        logger.warning(f"⚠️ [{self.name}] Disconnected from MQTT broker")
+        if rc != 0:
+            self.last_error = mqtt.error_string(rc)
+            logger.error(f"[{self.name}] Unexpected disconnection ({self.last_error}). Reconnecting with backoff...")
+
+    def on_message(self, client, userdata, msg):
+        kind = self.kind_for(msg.topic)
+        if kind is None:
+            self.unmatched += 1
+            logger.warning(f"[{self.name}] Ignoring message on unmapped topic {msg.topic}")
+            return
+        self.messages += 1
+        self.last_message_at = time.time()
+        # Waits while the pipeline is saturated, pushing back on this broker only
+        message = InboundMessage(self.name, msg.topic, msg.payload, kind)
+        while True:
+            try:
+                self.inbox.put(message, timeout=self.put_timeout)
+                break
+            except queue.Full:
+                if self.stalled_since is None:
+                    self.stalled_since = time.monotonic()
+                    self.inbox_stalls += 1
+                    logger.warning(f"[{self.name}] Inbox full, holding message on {msg.topic}")
+                if self.give_up_at is not None and time.monotonic() >= self.give_up_at:
+                    self._end_stall()
+                    self.abandoned += 1
+                    # Raising rather than returning keeps paho from acknowledging the message
+                    raise BrokerStopped(f"[{self.name}] Shutdown deadline passed, leaving message on "
+                                        f"{msg.topic} for redelivery")
+        if self.stalled_since is not None:
+            logger.info(f"[{self.name}] Inbox accepted messages again after "
+                        f"{time.monotonic() - self.stalled_since:.1f}s")
+            self._end_stall()
+
+    def _end_stall(self):
+        self.stalled_seconds += time.monotonic() - self.stalled_since
+        self.stalled_since = None
+
+    def kind_for(self, topic):
+        for subscription, kind in self.topics.items():
+            if mqtt.topic_matches_sub(subscription, topic):
+                return kind
+        return None
+
+    def snapshot(self):
+        return {
+            "host": f"{self.host}:{self.port}",
+            "connected": self.is_connected(),
+            "messages": self.messages,
+            "unmatched": self.unmatched,
+            "connects": self.connects,
+            "connect_failures": self.connect_failures,
+            "disconnects": self.disconnects,
+            "last_message_at": self.last_message_at,
+            "last_error": self.last_error,
+            "inbox_stalls": self.inbox_stalls,
+            "stalled_seconds": round(self.stalled_seconds, 1),
+            "stalled": self.stalled_since is not None,
+            "abandoned": self.abandoned,
+        }
+
+
+def create_brokers(config, inbox, read_section):
+    """Build a BrokerConnection for every configured broker.
+
+    MQTT_BROKERS lists broker names, each configured in a [broker:<name>]
+    section (HOST, PORT, USERNAME, PASSWORD, CLIENT_ID, QOS, TOPICS).
+    Without it the single MQTT_BROKER host is used with the default topics.
+
+    A broker without CLIENT_ID uses "<MQTT_CLIENT_ID>-<name>", so its QoS 1
+    messages survive restarts in a persistent session. A QoS 1 broker with
+    neither is rejected, as a clean session would lose them.
+    """
+    names = [n.strip() for n in config.get('MQTT_BROKERS', '').split(',') if n.strip()]
+    min_backoff = int(config.get('MQTT_MIN_BACKOFF', 1))
+    max_backoff = int(config.get('MQTT_MAX_BACKOFF', 60))
+
+    if not names:
+        return [BrokerConnection(
+            'default',
+            config.get('MQTT_BROKER', 'localhost'),
+            int(os.getenv('MQTT_PORT', '1883')),
+            dict(DEFAULT_TOPICS),
+            inbox,
+            client_id=config.get('MQTT_CLIENT_ID', ''),
+            qos=int(config.get('MQTT_QOS', 1)),
+            min_backoff=min_backoff,
+            max_backoff=max_backoff
+        )]
+
+    brokers = []
+    for name in names:
+        section = read_section(f"broker:{name}")
+        if not section.get('HOST'):
+            raise ValueError(f"MQTT broker '{name}' has no HOST in [broker:{name}]")
+        topics = parse_topic_map(section['TOPICS']) if section.get('TOPICS') else dict(DEFAULT_TOPICS)
+        qos = int(section.get('QOS', config.get('MQTT_QOS', 1)))
+        client_id = section.get('CLIENT_ID')
+        if not client_id and config.get('MQTT_CLIENT_ID'):
+            client_id = f"{config['MQTT_CLIENT_ID']}-{name}"
+        if not client_id and qos >= 1:
+            raise ValueError(f"MQTT broker '{name}' needs CLIENT_ID in [broker:{name}] "
+                             f"(or MQTT_CLIENT_ID) for a persistent QoS {qos} session")
+        brokers.append(BrokerConnection(
+            name,
+            section['HOST'],
+            int(section.get('PORT', 1883)),
+            topics,
+            inbox,
+            username=section.get('USERNAME'),
+            password=section.get('PASSWORD'),
+            client_id=client_id or '',
+            qos=qos,
+            min_backoff=min_backoff,
+            max_backoff=max_backoff
+        ))
+    return brokers
@@ -6,7 +6,6 @@ from datetime import datetime
 import psutil
 import paho.mqtt.client as mqtt
 import logging
-import mysql.connector
 
 # Setup logging
 logging.basicConfig(
@@ -15,36 +14,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Extra sections reported by /health, keyed by name
+status_providers = {}
+# Returns True while the subscriber is connected to MQTT
+mqtt_check = None
+# Returns True while the subscriber's databases are reachable. Called on the
+# single HTTP server thread, so it must answer from cached state: no queries,
+# no lock waits and no reconnects.
+db_check = None
+
+
+def register_status_provider(name, provider):
+    """Include provider()'s result under `name` in the /health response"""
+    status_providers[name] = provider
+
+
+def register_mqtt_check(check):
+    """Use check() to report the MQTT connection status"""
+    global mqtt_check
+    mqtt_check = check
+
+
+def register_db_check(check):
+    """Use check() to report the database connection status"""
+    global db_check
+    db_check = check
+
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
     @staticmethod
     def ensure_db_connection():
         try:
-            conn = mysql.connector.connect(
-                host="rfid_mysql",
-                user="root",
-                password="",
-                database="rfid_db",
-                connect_timeout=5
-            )
-            conn.close()
-            return True
+            return bool(db_check and db_check())
         except Exception as e:
+            logger.error(f"Database health check failed: {e}")
             return False
 
     def do_GET(self):
-        global client
         if self.path == '/health':
             try:
                 # Get process info
                 process = psutil.Process()
                 memory_info = process.memory_info()
 
-                # Check MySQL connection
+                # Check database connection
                 db_status = "ok" if self.ensure_db_connection() else "error"
 
                 # Check MQTT connection
-                mqtt_status = "ok" if client and client.is_connected() else "error"
+                mqtt_status = "ok" if mqtt_check and mqtt_check() else "error"
 
                 health_data = {
                     "status": "ok" if db_status == "ok" and mqtt_status == "ok" else "error",
@@ -60,6 +77,8 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
                     },
                     "uptime": time.time() - process.create_time()
                 }
+                for name, provider in status_providers.items():
+                    health_data[name] = provider()
 
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
@@ -0,0 +1,213 @@
+import os
+import time
+import logging
+import itertools
+import threading
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - export is optional
+    pa = None
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+# Column layout of an exported scan segment
+SCAN_COLUMNS = [
+    'scan_time', 'tenant_id', 'group_id', 'reader_id', 'card_uid',
+    'is_authorized', 'card_type', 'owner_name', 'source_topic'
+]
+
+# Keeps compacted file names unique within a process
+_compaction_sequence = itertools.count(1)
+
+
+def scan_schema():
+    """Arrow schema for exported scans"""
+    return pa.schema([
+        ('scan_time', pa.timestamp('s')),
+        ('tenant_id', pa.int32()),
+        ('group_id', pa.int32()),
+        ('reader_id', pa.string()),
+        ('card_uid', pa.string()),
+        ('is_authorized', pa.bool_()),
+        ('card_type', pa.string()),
+        ('owner_name', pa.string()),
+        ('source_topic', pa.string()),
+    ])
+
+
+def partition_dir(root_dir, tenant_id, day):
+    """Directory holding the segments of one tenant and day"""
+    return os.path.join(root_dir, f"tenant_id={tenant_id}", f"date={day}")
+
+
+def partition_dirs(root_dir, before_day=None):
+    """List (day, directory) of every partition, optionally only days before before_day"""
+    partitions = []
+    if not os.path.isdir(root_dir):
+        return partitions
+    for tenant_entry in sorted(os.listdir(root_dir)):
+        tenant_path = os.path.join(root_dir, tenant_entry)
+        if not tenant_entry.startswith('tenant_id=') or not os.path.isdir(tenant_path):
+            continue
+        for date_entry in sorted(os.listdir(tenant_path)):
+            day = date_entry[len('date='):]
+            if not date_entry.startswith('date=') or (before_day and day >= before_day):
+                continue
+            partitions.append((day, os.path.join(tenant_path, date_entry)))
+    return partitions
+
+
+def compact_partition(directory, compression='zstd'):
+    """Merge all segments of one partition into a single file; returns how many were merged.
+
+    The merged file is in place before the originals are removed, so a
+    reader listing the partition in between may see those rows twice but
+    never misses any.
+    """
+    names = sorted(n for n in os.listdir(directory) if n.endswith('.arrow'))
+    if len(names) < 2:
+        return 0
+    paths = [os.path.join(directory, n) for n in names]
+    table = pa.concat_tables([feather.read_table(p, memory_map=True) for p in paths])
+    path = os.path.join(
+        directory, f"scans-{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-"
+        f"compacted{next(_compaction_sequence):06d}.arrow"
+    )
+    feather.write_feather(table, path + '.tmp', compression=compression)
+    os.replace(path + '.tmp', path)
+    for old in paths:
+        os.remove(old)
+    logger.info(f"📦 Compacted {len(paths)} segments into {path} ({table.num_rows} scans)")
+    return len(paths)
+
+
+class SegmentWriter:
+    """Append enriched scans to rotating Arrow IPC (Feather v2) segments.
+
+    Rows are buffered per (tenant, day) partition and written out as a new
+    immutable segment file once a partition reaches ``max_rows`` or its
+    oldest buffered row is older than ``max_age`` seconds; buffered rows are
+    lost if the process dies, so ``max_age`` bounds that loss. Once a day is
+    over, its partitions are compacted into one file each.
+
+    Fresh segments are uncompressed by default so readers can memory-map
+    them and load only the columns they need without decoding. Compacted
+    days are the long-term archive and use ``archive_compression``.
+    """
+
+    def __init__(self, root_dir, max_rows=50000, max_age=300, compression='uncompressed',
+                 archive_compression='zstd'):
+        self.root_dir = root_dir
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.compression = compression
+        self.archive_compression = archive_compression
+        self.buffers = {}
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.stopped = threading.Event()
+        self.thread = None
+        # Days before this one have been compacted
+        self.compacted_before = None
+
+    def start(self):
+        """Start the background thread that rotates idle partitions"""
+        os.makedirs(self.root_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._rotate_loop, daemon=True)
+        self.thread.start()
+        logger.info(f"📦 Segment export enabled in {self.root_dir}")
+
+    def append(self, scan):
+        """Buffer one scan (a dict keyed by SCAN_COLUMNS)"""
+        key = (scan['tenant_id'], scan['scan_time'].strftime('%Y-%m-%d'))
+        with self.lock:
+            buffer = self.buffers.get(key)
+            if buffer is None:
+                buffer = {'created': time.monotonic(), 'rows': {c: [] for c in SCAN_COLUMNS}}
+                self.buffers[key] = buffer
+            for column in SCAN_COLUMNS:
+                buffer['rows'][column].append(scan.get(column))
+            if len(buffer['rows']['scan_time']) >= self.max_rows:
+                self._write_segment(key, self.buffers.pop(key))
+
+    def flush(self, expired_only=False):
+        """Write buffered partitions to disk"""
+        now = time.monotonic()
+        with self.lock:
+            for key in list(self.buffers):
+                if expired_only and now - self.buffers[key]['created'] < self.max_age:
+                    continue
+                self._write_segment(key, self.buffers.pop(key))
+
+    def close(self):
+        """Stop the rotation thread and flush everything still buffered"""
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.flush()
+
+    def _rotate_loop(self):
+        interval = max(1, min(self.max_age, 30))
+        while not self.stopped.wait(interval):
+            try:
+                self.flush(expired_only=True)
+                self.compact_closed_days()
+            except Exception as e:
+                logger.error(f"Failed to rotate scan segments: {e}")
+
+    def compact_closed_days(self):
+        """Compact the partitions of past days that have no rows left to write"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        if self.compacted_before == today:
+            return
+        with self.lock:
+            open_days = {day for _, day in self.buffers}
+        # A past day still buffering rows is compacted once they are written
+        before_day = min(open_days | {today})
+        for _, directory in partition_dirs(self.root_dir, before_day):
+            try:
+                compact_partition(directory, self.archive_compression)
+            except Exception as e:
+                logger.error(f"Failed to compact scan segments in {directory}: {e}")
+        if before_day == today:
+            self.compacted_before = today
+
+    def _write_segment(self, key, buffer):
+        tenant_id, day = key
+        directory = partition_dir(self.root_dir, tenant_id, day)
+        self.sequence += 1
+        name = f"scans-{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self.sequence:06d}.arrow"
+        path = os.path.join(directory, name)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            table = pa.Table.from_pydict(buffer['rows'], schema=scan_schema())
+            # Write under a temporary name so readers never see partial segments
+            feather.write_feather(table, path + '.tmp', compression=self.compression)
+            os.replace(path + '.tmp', path)
+            logger.info(f"📦 Wrote segment {path} ({table.num_rows} scans)")
+        except Exception as e:
+            logger.error(f"Failed to write scan segment {path}: {e}")
+
+
+def create_segment_writer(config):
+    """Build a started SegmentWriter from config, or None when export is disabled"""
+    root_dir = config.get('SEGMENT_DIR')
+    if not root_dir:
+        return None
+    if pa is None:
+        logger.warning("SEGMENT_DIR is set but pyarrow is not installed - segment export disabled")
+        return None
+
+    writer = SegmentWriter(
+        root_dir,
+        max_rows=int(config.get('SEGMENT_MAX_ROWS', 50000)),
+        max_age=int(config.get('SEGMENT_MAX_AGE', 300)),
+        compression=config.get('SEGMENT_COMPRESSION', 'uncompressed'),
+        archive_compression=config.get('SEGMENT_ARCHIVE_COMPRESSION', 'zstd')
+    )
+    writer.start()
+    return writer
@@ -0,0 +1,144 @@
+"""Run analytics reports against exported scan segments.
+
+Reads the Arrow segments written by segment_export.SegmentWriter using
+memory mapping, loading only the columns each report needs and skipping
+partitions outside the requested tenant/date range. The compact command
+merges each matching partition's segments into one zstd-compressed file.
+
+Examples:
+    python segment_query.py --dir segments reader-monthly --tenant 3
+    python segment_query.py --dir segments card-dwell --from 2025-01-01 --to 2025-01-31
+    python segment_query.py --dir segments dump --columns scan_time,card_uid --limit 20
+    python segment_query.py --dir segments compact --to 2025-01-31
+"""
+import os
+import sys
+import argparse
+import logging
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from segment_export import SCAN_COLUMNS, scan_schema, compact_partition
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def find_segments(root_dir, tenant_id=None, date_from=None, date_to=None):
+    """List segment files, pruning partitions by tenant and date"""
+    segments = []
+    if not os.path.isdir(root_dir):
+        return segments
+
+    for tenant_entry in sorted(os.listdir(root_dir)):
+        if not tenant_entry.startswith('tenant_id='):
+            continue
+        if tenant_id is not None and tenant_entry != f"tenant_id={tenant_id}":
+            continue
+        tenant_path = os.path.join(root_dir, tenant_entry)
+        for date_entry in sorted(os.listdir(tenant_path)):
+            if not date_entry.startswith('date='):
+                continue
+            day = date_entry[len('date='):]
+            if (date_from and day < date_from) or (date_to and day > date_to):
+                continue
+            date_path = os.path.join(tenant_path, date_entry)
+            for name in sorted(os.listdir(date_path)):
+                if name.endswith('.arrow'):
+                    segments.append(os.path.join(date_path, name))
+    return segments
+
+
+def load_scans(root_dir, columns, tenant_id=None, date_from=None, date_to=None):
+    """Load the given columns of all matching segments into one table"""
+    tables = [
+        feather.read_table(path, columns=columns, memory_map=True)
+        for path in find_segments(root_dir, tenant_id, date_from, date_to)
+    ]
+    if not tables:
+        schema = scan_schema()
+        return pa.table({c: pa.array([], type=schema.field(c).type) for c in columns})
+    return pa.concat_tables(tables)
+
+
+def reader_monthly(table):
+    """Scan count per reader and month"""
+    table = table.append_column('month', pc.strftime(table['scan_time'], format='%Y-%m'))
+    result = table.group_by(['reader_id', 'month']).aggregate([('card_uid', 'count')])
+    result = result.rename_columns(['reader_id', 'month', 'scans'])
+    return result.sort_by([('month', 'ascending'), ('scans', 'descending')])
+
+
+def card_dwell(table):
+    """First/last sighting and dwell time per card and day"""
+    table = table.append_column('day', pc.strftime(table['scan_time'], format='%Y-%m-%d'))
+    result = table.group_by(['card_uid', 'day']).aggregate([
+        ('scan_time', 'min'),
+        ('scan_time', 'max'),
+        ('scan_time', 'count'),
+    ])
+    result = result.rename_columns(['card_uid', 'day', 'first_seen', 'last_seen', 'scans'])
+    dwell = pc.divide(
+        pc.cast(pc.subtract(result['last_seen'], result['first_seen']), pa.int64()), 60
+    )
+    result = result.append_column('dwell_minutes', dwell)
+    return result.sort_by([('day', 'ascending'), ('dwell_minutes', 'descending')])
+
+
+REPORTS = {
+    'reader-monthly': (['scan_time', 'reader_id', 'card_uid'], reader_monthly),
+    'card-dwell': (['scan_time', 'card_uid'], card_dwell),
+}
+
+
+def print_table(table, limit=None):
+    if limit is not None:
+        table = table.slice(0, limit)
+    print('\t'.join(table.column_names))
+    for row in table.to_pylist():
+        print('\t'.join('' if v is None else str(v) for v in row.values()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query exported RFID scan segments")
+    parser.add_argument('--dir', default='segments', help="Segment root directory (SEGMENT_DIR)")
+    parser.add_argument('--tenant', type=int, help="Only read this tenant's partitions")
+    parser.add_argument('--from', dest='date_from', help="First day to include (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='date_to', help="Last day to include (YYYY-MM-DD)")
+    parser.add_argument('--limit', type=int, help="Maximum number of rows to print")
+    parser.add_argument('--columns', default=','.join(SCAN_COLUMNS), help="Columns for the dump report")
+    parser.add_argument('--compression', default='zstd', help="Codec of compacted files")
+    parser.add_argument('report', choices=sorted(REPORTS) + ['dump', 'compact'])
+    args = parser.parse_args(argv)
+
+    if args.report == 'compact':
+        directories = sorted({
+            os.path.dirname(path)
+            for path in find_segments(args.dir, args.tenant, args.date_from, args.date_to)
+        })
+        merged = sum(compact_partition(d, args.compression) for d in directories)
+        logger.info(f"Compacted {merged} segments in {len(directories)} partitions")
+        return 0
+
+    if args.report == 'dump':
+        columns = [c.strip() for c in args.columns.split(',') if c.strip()]
+        unknown = [c for c in columns if c not in SCAN_COLUMNS]
+        if unknown:
+            parser.error(f"Unknown columns: {', '.join(unknown)}")
+        report = None
+    else:
+        columns, report = REPORTS[args.report]
+
+    table = load_scans(args.dir, columns, args.tenant, args.date_from, args.date_to)
+    logger.info(f"Loaded {table.num_rows} scans ({', '.join(columns)})")
+    print_table(report(table) if report else table, args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,521 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+# Rows read from the primary database
+ReaderInfo = namedtuple('ReaderInfo', ['tenant_id', 'id', 'name', 'location', 'group_id'])
+CardInfo = namedtuple('CardInfo', ['is_active', 'tenant_id', 'owner_name', 'card_type'])
+
+# Rows written by the subscriber
+ScanRecord = namedtuple('ScanRecord', [
+    'card_uid', 'reader_id', 'is_authorized', 'timestamp', 'tenant_id', 'raw_data', 'notes'
+])
+ScanEntry = namedtuple('ScanEntry', ['device_id', 'tag_id', 'tenant_id', 'group_id', 'scan_time'])
+ErrorRecord = namedtuple('ErrorRecord', [
+    'tenant_id', 'error_type', 'error_message', 'raw_data', 'source_topic', 'stack_trace', 'created_at'
+])
+Heartbeat = namedtuple('Heartbeat', ['reader_id', 'seen_at'])
+NewReader = namedtuple('NewReader', ['reader_id', 'name', 'location', 'tenant_id'])
+
+
+class StorageBackend(ABC):
+    """Persistence used by the subscriber.
+
+    The primary database holds readers, cards, rfid_logs and error_logs;
+    the secondary database receives rfid_scan_entry rows. Every operation
+    takes or returns a batch so callers can group work per round-trip.
+    Access to each connection is serialized, so lookups and background
+    writers may share one backend across threads.
+
+    Connection management takes ``secondary``: False for the primary
+    connection, True for the secondary one and None for both.
+    """
+
+    # Parameter placeholder of the underlying DB-API driver
+    placeholder = '%s'
+    # Largest IN (...) list sent in one lookup; bigger key sets are split
+    max_keys_per_query = 500
+    # Driver errors caused by the data of a row rather than the connection
+    row_errors = ()
+
+    def __init__(self):
+        self.db = None
+        self.db2 = None
+        self.lock = threading.RLock()
+        self.lock2 = threading.RLock()
+        # Last known state of each connection (keyed by secondary), as seen
+        # by connection checks and writes; read without locking or I/O
+        self.healthy = {False: False, True: False}
+
+    @abstractmethod
+    def connect(self, secondary=None):
+        """Open the selected connections, returning True on success"""
+
+    @abstractmethod
+    def is_connected(self, secondary=None):
+        """Cheap liveness probe of the selected connections"""
+
+    @staticmethod
+    def _sides(secondary):
+        return (False, True) if secondary is None else (secondary,)
+
+    def _lock_for(self, secondary):
+        return self.lock2 if secondary else self.lock
+
+    def ensure_connection(self, secondary=None):
+        """Check the selected connections and reconnect if necessary.
+
+        Each connection is checked under its own lock only, so checking
+        the secondary database never waits on a write to the primary.
+        """
+        for side in self._sides(secondary):
+            label = 'second' if side else 'first'
+            with self._lock_for(side):
+                if (self.db2 if side else self.db) is None:
+                    logger.info(f"Connecting to the {label} database...")
+                elif self.is_connected(side):
+                    self.healthy[side] = True
+                    continue
+                else:
+                    logger.warning(f"{label.capitalize()} database connection lost. Reconnecting...")
+                    self.close(side)
+                self.healthy[side] = self.connect(side)
+                if not self.healthy[side]:
+                    return False
+        return True
+
+    def is_healthy(self, secondary=None):
+        """Last known state of the selected connections, without touching them.
+
+        Safe to call from any thread (e.g. health probes): it never waits
+        on a lock, queries the database or reconnects.
+        """
+        return all(self.healthy[side] for side in self._sides(secondary))
+
+    def close(self, secondary=None):
+        for side in self._sides(secondary):
+            with self._lock_for(side):
+                conn = self.db2 if side else self.db
+                if conn is None:
+                    continue
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                # A backend sharing one connection for both sides loses both
+                if self.db is conn:
+                    self.db = None
+                    self.healthy[False] = False
+                if self.db2 is conn:
+                    self.db2 = None
+                    self.healthy[True] = False
+
+    def _chunks(self, keys):
+        for start in range(0, len(keys), self.max_keys_per_query):
+            yield keys[start:start + self.max_keys_per_query]
+
+    def _placeholders(self, count):
+        return ', '.join([self.placeholder] * count)
+
+    def resolve_readers(self, reader_ids):
+        """Map each known reader_id to its ReaderInfo"""
+        reader_ids = list(dict.fromkeys(reader_ids))
+        if not reader_ids:
+            return {}
+        found = {}
+        with self.lock:
+            for chunk in self._chunks(reader_ids):
+                found.update(self._fetch_readers(chunk))
+        return found
+
+    def _fetch_readers(self, reader_ids):
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT r.reader_id, r.tenant_id, r.id, r.name, r.location, r.reader_group_id AS group_id
+                FROM rfid_readers r
+                WHERE r.reader_id IN ({self._placeholders(len(reader_ids))})
+            """, reader_ids)
+            return {row[0]: ReaderInfo(*row[1:]) for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def resolve_cards(self, card_uids):
+        """Map each known card_uid to its CardInfo (owner and effective type).
+
+        Card UIDs missing from the result are unknown.
+        """
+        card_uids = list(dict.fromkeys(card_uids))
+        if not card_uids:
+            return {}
+        found = {}
+        with self.lock:
+            for chunk in self._chunks(card_uids):
+                found.update(self._fetch_cards(chunk))
+        return found
+
+    def _fetch_cards(self, card_uids):
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT c.card_uid, c.is_active, c.tenant_id,
+                       COALESCE(s.first_name, v.owner_name) as owner_name,
+                       CASE
+                         WHEN s.id IS NOT NULL THEN 'staff'
+                         WHEN v.id IS NOT NULL THEN 'vehicle'
+                         ELSE c.card_type
+                       END as type
+                FROM rfid_cards c
+                LEFT JOIN staff s ON c.staff_id = s.id
+                LEFT JOIN vehicles v ON c.vehicle_id = v.id
+                WHERE c.card_uid IN ({self._placeholders(len(card_uids))})
+            """, card_uids)
+            return {row[0]: CardInfo(*row[1:]) for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def write_scans(self, scans):
+        """Insert ScanRecords into rfid_logs; returns the rejected (scan, error) pairs"""
+        return self._executemany(False, f"""
+            INSERT INTO rfid_logs (
+                card_uid, reader_id, is_authorized, timestamp, tenant_id,
+                event_type, raw_data, notes
+            ) VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder},
+                      {self.placeholder}, 'scan', {self.placeholder}, {self.placeholder})
+        """, scans)
+
+    def write_scan_entries(self, entries):
+        """Insert ScanEntries into rfid_scan_entry on the secondary database;
+        returns the rejected (entry, error) pairs"""
+        return self._executemany(True, f"""
+            INSERT INTO rfid_scan_entry
+            (rfid_device_unique_id, rfid_tag_unique_id, tenant_id, group_id, scan_time)
+            VALUES ({self._placeholders(5)})
+        """, entries)
+
+    def write_errors(self, errors):
+        """Insert ErrorRecords into error_logs; returns the rejected (error, exception) pairs"""
+        return self._executemany(False, f"""
+            INSERT INTO error_logs
+            (tenant_id, error_type, error_message, raw_data, source_topic, stack_trace, created_at)
+            VALUES ({self._placeholders(7)})
+        """, errors)
+
+    def update_liveness(self, heartbeats):
+        """Mark readers online with their latest Heartbeat time; returns the rejected
+        (heartbeat, error) pairs"""
+        latest = {}
+        for hb in heartbeats:
+            if hb.reader_id not in latest or hb.seen_at > latest[hb.reader_id].seen_at:
+                latest[hb.reader_id] = hb
+        return self._executemany(False, f"""
+            UPDATE rfid_readers
+            SET last_heartbeat = {self.placeholder}, is_online = TRUE
+            WHERE reader_id = {self.placeholder}
+        """, list(latest.values()), lambda hb: (hb.seen_at, hb.reader_id))
+
+    def create_readers(self, readers):
+        """Insert NewReaders into rfid_readers; returns the rejected (reader, error) pairs"""
+        return self._executemany(False, f"""
+            INSERT INTO rfid_readers (reader_id, name, location, tenant_id, is_online)
+            VALUES ({self._placeholders(4)}, TRUE)
+        """, readers)
+
+    def _executemany(self, secondary, sql, items, to_params=tuple):
+        """Write items in one statement and commit.
+
+        When the database rejects the data itself (``row_errors``), the
+        batch is bisected so only the offending rows are returned as
+        (item, error) pairs and every other row is still committed. Any
+        other error, such as a lost connection, is raised for the batch.
+        """
+        if not items:
+            return []
+        with self._lock_for(secondary):
+            conn = self.db2 if secondary else self.db
+            try:
+                rejected = self._write_rows(conn, sql, items, to_params)
+            except Exception:
+                self.healthy[secondary] = False
+                raise
+            self.healthy[secondary] = True
+            return rejected
+
+    def _write_rows(self, conn, sql, items, to_params):
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(sql, [to_params(item) for item in items])
+            conn.commit()
+            return []
+        except self.row_errors as err:
+            conn.rollback()
+            if len(items) == 1:
+                return [(items[0], err)]
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        middle = len(items) // 2
+        return (self._write_rows(conn, sql, items[:middle], to_params)
+                + self._write_rows(conn, sql, items[middle:], to_params))
+
+
+class MySQLStorage(StorageBackend):
+    """Primary and secondary MySQL databases configured in database.init"""
+
+    row_errors = (mysql.connector.DataError, mysql.connector.IntegrityError)
+
+    def __init__(self, config, max_retries=5, retry_delay=5, should_stop=None):
+        super().__init__()
+        self.config = config
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Checked between attempts so a shutdown during startup is not held up
+        self.should_stop = should_stop or (lambda: False)
+
+    def _connect_one(self, label, **params):
+        retry_count = 0
+        while retry_count < self.max_retries and not self.should_stop():
+            try:
+                conn = mysql.connector.connect(connection_timeout=10, **params)
+                logger.info(f"Successfully connected to the {label} database.")
+                return conn
+            except mysql.connector.Error as err:
+                retry_count += 1
+                logger.error("%s database connection failed (attempt %d): %s", label, retry_count, err)
+                if retry_count < self.max_retries:
+                    self._sleep(self.retry_delay)
+        if self.should_stop():
+            logger.info(f"Stopped connecting to {label} database: shutdown requested")
+        else:
+            logger.error(f"Failed to connect to {label} database after maximum retries")
+        return None
+
+    def _sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.should_stop() and time.monotonic() < deadline:
+            time.sleep(min(0.5, deadline - time.monotonic()))
+
+    def _params(self, suffix, port_env):
+        config = self.config
+        return dict(
+            host=config.get(f'DB_HOST{suffix}', 'localhost'),
+            port=int(os.getenv(port_env, "3306")),
+            user=config.get(f'DB_USER{suffix}', 'rfid'),
+            password=config.get(f'DB_PASSWORD{suffix}', 'rfidpass'),
+            database=config.get(f'DB_NAME{suffix}', 'rfid_db2' if suffix else 'rfid_db')
+        )
+
+    def connect(self, secondary=None):
+        if secondary is not True:
+            self.db = self._connect_one('first', **self._params('', "DB_PORT"))
+            if self.db is None:
+                return False
+        if secondary is not False:
+            self.db2 = self._connect_one('second', **self._params('2', "DB_PORT2"))
+            if self.db2 is None:
+                return False
+        return True
+
+    def is_connected(self, secondary=None):
+        try:
+            for side in self._sides(secondary):
+                cursor = (self.db2 if side else self.db).cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+                cursor.close()
+            return True
+        except mysql.connector.Error as err:
+            logger.warning(f"Database connection lost: {err}")
+            return False
+
+
+# Mirrors the tables of mysql/init.sql that the subscriber touches. SQLite
+# neither enforces VARCHAR lengths nor validates JSON, so the columns the
+# subscriber writes carry CHECKs rejecting what MySQL in strict mode rejects.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS staff (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    employee_id TEXT UNIQUE NOT NULL,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    email TEXT,
+    phone TEXT,
+    department TEXT,
+    position TEXT,
+    hire_date DATE,
+    is_active BOOLEAN DEFAULT TRUE,
+    emergency_contact_name TEXT,
+    emergency_contact_phone TEXT,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS vehicles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    license_plate TEXT UNIQUE NOT NULL,
+    vehicle_type TEXT,
+    make TEXT,
+    model TEXT,
+    year TEXT,
+    color TEXT,
+    owner_name TEXT,
+    owner_phone TEXT,
+    owner_email TEXT,
+    is_active BOOLEAN DEFAULT TRUE,
+    registration_date DATE,
+    insurance_expiry DATE,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS rfid_readers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    reader_group_id INTEGER NULL,
+    reader_id TEXT UNIQUE NOT NULL CHECK (length(reader_id) <= 50),
+    name TEXT NOT NULL CHECK (length(name) <= 100),
+    location TEXT CHECK (length(location) <= 200),
+    ip_address TEXT,
+    mac_address TEXT,
+    is_online BOOLEAN DEFAULT TRUE,
+    last_heartbeat DATETIME,
+    configuration TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS rfid_cards (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    card_uid TEXT UNIQUE NOT NULL,
+    card_type TEXT NOT NULL CHECK (card_type IN ('staff', 'vehicle', 'visitor', 'guest')),
+    staff_id INTEGER NULL,
+    vehicle_id INTEGER NULL,
+    description TEXT,
+    is_active BOOLEAN DEFAULT TRUE,
+    issued_at DATETIME,
+    expires_at DATETIME,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS rfid_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    card_uid TEXT NOT NULL CHECK (length(card_uid) <= 50),
+    reader_id TEXT NOT NULL CHECK (length(reader_id) <= 50),
+    event_type TEXT DEFAULT 'scan' CHECK (length(event_type) <= 50),
+    raw_data TEXT,
+    is_authorized BOOLEAN DEFAULT TRUE,
+    notes TEXT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS error_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER DEFAULT 1,
+    error_type TEXT NOT NULL CHECK (error_type IN (
+        'mqtt_parse_error', 'database_error', 'validation_error', 'unknown_reader',
+        'unknown_card', 'general_error', 'system_error', 'parse_error'
+    )),
+    error_message TEXT NOT NULL,
+    raw_data TEXT CHECK (raw_data IS NULL OR json_valid(raw_data)),
+    source_topic TEXT CHECK (length(source_topic) <= 200),
+    source_ip TEXT,
+    stack_trace TEXT,
+    resolved BOOLEAN DEFAULT FALSE,
+    resolved_by TEXT,
+    resolved_at TIMESTAMP NULL,
+    resolution_notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+SQLITE_SCHEMA2 = """
+CREATE TABLE IF NOT EXISTS rfid_scan_entry (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    rfid_device_unique_id TEXT NOT NULL,
+    rfid_tag_unique_id TEXT NOT NULL,
+    tenant_id INTEGER,
+    group_id INTEGER,
+    scan_time DATETIME
+);
+"""
+
+
+class SQLiteStorage(StorageBackend):
+    """Local SQLite stand-in with the same tables the subscriber uses.
+
+    ``path2`` defaults to ``path``, in which case rfid_scan_entry lives in
+    the same file. Use ':memory:' for throwaway benchmark runs.
+    """
+
+    placeholder = '?'
+    row_errors = (sqlite3.DataError, sqlite3.IntegrityError)
+
+    def __init__(self, path=':memory:', path2=None):
+        super().__init__()
+        self.path = path
+        self.path2 = path2
+
+    def _open(self, path, schema):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.executescript(schema)
+        return conn
+
+    def connect(self, secondary=None):
+        try:
+            if not self.path2 or self.path2 == self.path:
+                # One file: both sides share the connection, so they must share its lock
+                self.db = self.db2 = self._open(self.path, SQLITE_SCHEMA + SQLITE_SCHEMA2)
+                self.lock2 = self.lock
+            else:
+                if secondary is not True:
+                    self.db = self._open(self.path, SQLITE_SCHEMA)
+                if secondary is not False:
+                    self.db2 = self._open(self.path2, SQLITE_SCHEMA2)
+            logger.info(f"Using SQLite storage at {self.path}")
+            return True
+        except sqlite3.Error as err:
+            logger.error(f"Failed to open SQLite storage {self.path}: {err}")
+            return False
+
+    def is_connected(self, secondary=None):
+        try:
+            for side in self._sides(secondary):
+                (self.db2 if side else self.db).execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as err:
+            logger.warning(f"SQLite storage unavailable: {err}")
+            return False
+
+
+def create_storage(config, should_stop=None):
+    """Build the storage backend selected by STORAGE_BACKEND (mysql or sqlite).
+
+    should_stop() is polled while MySQL connection attempts are retried.
+    """
+    backend = config.get('STORAGE_BACKEND', 'mysql').lower()
+    if backend == 'sqlite':
+        return SQLiteStorage(
+            config.get('SQLITE_PATH', ':memory:'),
+            config.get('SQLITE_PATH2') or None
+        )
+    if backend != 'mysql':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return MySQLStorage(config, should_stop=should_stop)
@@ -0,0 +1,91 @@
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from brokers import DEFAULT_TOPICS, BrokerConnection, create_brokers, parse_topic_map
+
+
+def broker(topics=None, inbox=None, **kwargs):
+    return BrokerConnection('site', 'localhost', 1883, topics or dict(DEFAULT_TOPICS),
+                            inbox if inbox is not None else queue.Queue(), **kwargs)
+
+
+def message(topic, payload=b'{}'):
+    return SimpleNamespace(topic=topic, payload=payload)
+
+
+def test_parse_topic_map():
+    assert parse_topic_map(" rfid/+/scan:scan, rfid/heartbeat:heartbeat,plain/topic ,") == {
+        'rfid/+/scan': 'scan',
+        'rfid/heartbeat': 'heartbeat',
+        'plain/topic': 'scan',
+    }
+
+
+def test_parse_topic_map_rejects_unknown_kind():
+    with pytest.raises(ValueError, match="heartbeats"):
+        parse_topic_map("rfid/heartbeat:heartbeats")
+
+
+def test_kind_for_matches_wildcards():
+    b = broker()
+    assert b.kind_for('rfid/reader-7/scan') == 'scan'
+    assert b.kind_for('rfid/heartbeat') == 'heartbeat'
+    assert b.kind_for('binimise/rfid/RunData') == 'scan'
+    assert b.kind_for('rfid/reader-7/status') is None
+
+
+def test_on_message_queues_mapped_and_counts_unmapped():
+    inbox = queue.Queue()
+    b = broker(inbox=inbox)
+    b.on_message(None, None, message('rfid/r1/scan', b'payload'))
+    b.on_message(None, None, message('other/topic'))
+    queued = inbox.get_nowait()
+    assert (queued.broker, queued.topic, queued.payload, queued.kind) == ('site', 'rfid/r1/scan', b'payload', 'scan')
+    assert inbox.empty()
+    assert (b.messages, b.unmatched) == (1, 1)
+
+
+def test_full_inbox_is_recorded_as_stall():
+    inbox = queue.Queue(maxsize=1)
+    b = broker(inbox=inbox, put_timeout=0.02)
+    b.on_message(None, None, message('rfid/scan'))
+    waiting = threading.Thread(target=b.on_message, args=(None, None, message('rfid/scan')))
+    waiting.start()
+    time.sleep(0.1)
+    assert b.snapshot()['stalled']
+    inbox.get_nowait()
+    waiting.join(2)
+    stats = b.snapshot()
+    assert (stats['inbox_stalls'], stats['stalled']) == (1, False)
+    assert stats['stalled_seconds'] > 0
+    assert inbox.qsize() == 1
+
+
+def test_create_brokers_default():
+    (b,) = create_brokers({'MQTT_BROKER': 'mqtt', 'MQTT_CLIENT_ID': 'sub'}, queue.Queue(), lambda name: {})
+    assert (b.name, b.host, b.topics) == ('default', 'mqtt', DEFAULT_TOPICS)
+
+
+def test_create_brokers_from_sections():
+    sections = {
+        'broker:a': {'HOST': 'a.local', 'PORT': '1884', 'TOPICS': 'x/scan:scan'},
+        'broker:b': {'HOST': 'b.local', 'CLIENT_ID': 'own-id'},
+    }
+    a, b = create_brokers({'MQTT_BROKERS': 'a, b', 'MQTT_CLIENT_ID': 'sub'}, queue.Queue(), sections.get)
+    assert (a.host, a.port, a.topics) == ('a.local', 1884, {'x/scan': 'scan'})
+    assert a.client._client_id == b'sub-a'
+    assert b.client._client_id == b'own-id'
+
+
+def test_create_brokers_requires_client_id_for_qos1():
+    with pytest.raises(ValueError, match="CLIENT_ID"):
+        create_brokers({'MQTT_BROKERS': 'a'}, queue.Queue(), lambda name: {'HOST': 'a.local'})
+
+
+def test_create_brokers_requires_host():
+    with pytest.raises(ValueError, match="HOST"):
+        create_brokers({'MQTT_BROKERS': 'a', 'MQTT_CLIENT_ID': 'sub'}, queue.Queue(), lambda name: {})
@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+import app
+from brokers import InboundMessage
+from storage import SQLiteStorage, ErrorRecord, Heartbeat
+
+
+class Queued:
+    def __init__(self):
+        self.items = []
+
+    def submit(self, item, block=True):
+        self.items.append(item)
+        return True
+
+    def of(self, kind):
+        return [i for i in self.items if isinstance(i, kind)]
+
+    def errors(self, error_type):
+        return [e for e in self.of(ErrorRecord) if e.error_type == error_type]
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = SQLiteStorage()
+    assert storage.connect()
+    storage.db.executemany(
+        "INSERT INTO rfid_readers (tenant_id, reader_group_id, reader_id, name) VALUES (?, ?, ?, ?)",
+        [(2, 7, 'R1', 'Gate'), (3, None, 'R2', 'Dock')]
+    )
+    storage.db.executemany(
+        "INSERT INTO rfid_cards (tenant_id, card_uid, card_type, is_active) VALUES (?, ?, 'visitor', ?)",
+        [(2, 'K1', True), (2, 'K2', False), (3, 'K3', True)]
+    )
+    storage.db.commit()
+
+    lookups = {'readers': [], 'cards': []}
+    resolve_readers, resolve_cards = storage.resolve_readers, storage.resolve_cards
+
+    def readers(ids):
+        ids = list(ids)
+        lookups['readers'].append(ids)
+        return resolve_readers(ids)
+
+    def cards(uids):
+        uids = list(uids)
+        lookups['cards'].append(uids)
+        return resolve_cards(uids)
+
+    monkeypatch.setattr(storage, 'resolve_readers', readers)
+    monkeypatch.setattr(storage, 'resolve_cards', cards)
+    storage.lookups = lookups
+    monkeypatch.setattr(app, 'storage', storage)
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    queued = Queued()
+    monkeypatch.setattr(app, 'db_batcher', queued)
+    return queued
+
+
+def payload(reader_id, *tags):
+    return json.dumps({
+        'deviceSn': 'SN1', 'deviceID': reader_id, 'tagNum': len(tags), 'tagID': ','.join(tags)
+    }).encode()
+
+
+def scans(*messages):
+    return [(payload(reader_id, *tags), 'binimise/rfid/RunData') for reader_id, *tags in messages]
+
+
+def test_one_lookup_per_micro_batch(storage, queued):
+    app.process_rfid_scans(scans(('R1', 'K1', 'K2'), ('R2', 'K3'), ('R1', 'K1')))
+    assert len(storage.lookups['readers']) == 1
+    assert sorted(storage.lookups['readers'][0]) == ['R1', 'R1', 'R2']
+    assert len(storage.lookups['cards']) == 1
+    assert sorted(set(storage.lookups['cards'][0])) == ['K1', 'K2', 'K3']
+
+    pending = queued.of(app.PendingScan)
+    assert [(p.record.reader_id, p.record.card_uid) for p in pending] == [
+        ('R1', 'K1'), ('R1', 'K2'), ('R2', 'K3'), ('R1', 'K1')
+    ]
+    assert [p.record.is_authorized for p in pending] == [True, False, True, True]
+    assert [(p.entry.tenant_id, p.entry.group_id) for p in pending] == [(2, 7), (2, 7), (3, 1), (2, 7)]
+    assert [h.reader_id for h in queued.of(Heartbeat)] == ['R1', 'R2', 'R1']
+
+
+def test_unknown_cards_are_written_unauthorized(storage, queued):
+    app.process_rfid_scans(scans(('R1', 'K1', 'NOPE')))
+    unknown = [p for p in queued.of(app.PendingScan) if p.record.card_uid == 'NOPE']
+    assert len(unknown) == 1
+    assert unknown[0].record.is_authorized is False
+    assert unknown[0].export['card_type'] == 'unknown'
+    assert [e.error_message for e in queued.errors(app.ERROR_UNKNOWN_CARD)] == ['Card not found in database: NOPE']
+
+
+def test_cards_of_unknown_readers_are_not_looked_up(storage, queued):
+    app.process_rfid_scans(scans(('R1', 'K1'), ('GHOST', 'K3')))
+    assert storage.lookups['cards'] == [['K1']]
+    assert len(queued.errors(app.ERROR_UNKNOWN_READER)) == 1
+    assert [p.record.card_uid for p in queued.of(app.PendingScan)] == ['K1']
+
+
+def test_lookup_failure_logs_one_database_error_per_scan(storage, queued, monkeypatch):
+    def fail(uids):
+        raise RuntimeError("lookup failed")
+
+    monkeypatch.setattr(storage, 'resolve_cards', fail)
+    app.process_rfid_scans(scans(('R1', 'K1', 'K2'), ('R2', 'K3'), ('R1', 'K1')))
+    errors = queued.errors(app.ERROR_DATABASE)
+    assert len(errors) == 3
+    assert all('lookup failed' in e.error_message for e in errors)
+    assert queued.of(app.PendingScan) == []
+
+
+def test_invalid_messages_do_not_stop_the_batch(storage, queued):
+    app.process_rfid_scans([(b'not json', 'rfid/scan')] + scans(('R1', 'K1')))
+    assert len(queued.errors(app.ERROR_PARSE)) == 1
+    assert [p.record.card_uid for p in queued.of(app.PendingScan)] == ['K1']
+
+
+def test_heartbeats_keep_their_position_between_scan_groups(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, 'process_rfid_scans', lambda messages: calls.append(('scans', len(messages))))
+    monkeypatch.setattr(app, 'handle_message', lambda message: calls.append(('heartbeat', message.payload)))
+    scan = InboundMessage('site', 'rfid/scan', b'{}', 'scan')
+    app.handle_messages([
+        scan, scan,
+        InboundMessage('site', 'rfid/heartbeat', b'hb1', 'heartbeat'),
+        scan,
+        InboundMessage('site', 'rfid/heartbeat', b'hb2', 'heartbeat'),
+    ])
+    assert calls == [('scans', 2), ('heartbeat', b'hb1'), ('scans', 1), ('heartbeat', b'hb2')]
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from brokers import BrokerConnection, BrokerStopped, InboundMessage
+
+
+class Recorder:
+    def __init__(self, events, name):
+        self.events = events
+        self.name = name
+        self.put_timeout = 0.1
+
+    def disconnect(self, deadline=None):
+        self.events.append(f"{self.name} disconnect")
+
+    def stop(self, timeout=None):
+        self.events.append(f"{self.name} stop")
+
+    def close(self):
+        self.events.append(f"{self.name} close")
+
+
+class Batcher(Recorder):
+    def stop(self, timeout=None):
+        self.events.append(f"{self.name} flush")
+
+
+@pytest.fixture
+def events(monkeypatch):
+    events = []
+    inbox = queue.Queue()
+    for i in range(3):
+        inbox.put(InboundMessage('site', 'rfid/scan', b'{}', 'scan'))
+    monkeypatch.setattr(app, 'inbox', inbox)
+    monkeypatch.setattr(app, 'brokers', [Recorder(events, 'broker-a'), Recorder(events, 'broker-b')])
+    monkeypatch.setattr(app, 'handle_messages', lambda messages: events.append(f"handle {len(messages)}"))
+    monkeypatch.setattr(app, 'db_batcher', Batcher(events, 'db'))
+    monkeypatch.setattr(app, 'db2_batcher', Batcher(events, 'db2'))
+    monkeypatch.setattr(app, 'segment_writer', Recorder(events, 'segments'))
+    monkeypatch.setattr(app, 'storage', Recorder(events, 'storage'))
+    return events
+
+
+def test_shutdown_order(events):
+    app.shutdown(5)
+    assert events == [
+        'broker-a disconnect', 'broker-b disconnect',
+        'handle 3',
+        'broker-a stop', 'broker-b stop',
+        'db flush', 'db2 flush',
+        'segments close',
+        'storage close',
+    ]
+    assert app.state == 'stopped'
+
+
+def test_shutdown_respects_deadline_with_stalled_broker(monkeypatch):
+    inbox = queue.Queue(maxsize=1)
+    inbox.put(InboundMessage('site', 'rfid/scan', b'{}', 'scan'))
+    broker = BrokerConnection('site', 'localhost', 1883, {'rfid/scan': 'scan'}, inbox,
+                              client_id='test', put_timeout=0.05)
+    raised = []
+
+    def network_thread():
+        try:
+            broker.on_message(None, None, SimpleNamespace(topic='rfid/scan', payload=b'{}'))
+        except BrokerStopped as e:
+            raised.append(e)
+
+    # Stand in for paho's network thread, stuck putting onto the full inbox
+    thread = threading.Thread(target=network_thread, daemon=True)
+    broker.client._thread = thread
+    thread.start()
+
+    monkeypatch.setattr(app, 'inbox', inbox)
+    monkeypatch.setattr(app, 'brokers', [broker])
+    # The pipeline is wedged: nothing can be taken off the inbox
+    monkeypatch.setattr(app, 'take_messages', lambda first=None: [])
+    monkeypatch.setattr(app, 'db_batcher', None)
+    monkeypatch.setattr(app, 'db2_batcher', None)
+    monkeypatch.setattr(app, 'segment_writer', None)
+    monkeypatch.setattr(app, 'storage', None)
+
+    started = time.monotonic()
+    app.shutdown(0.3)
+    assert time.monotonic() - started < 1.0
+    assert not thread.is_alive()
+    assert len(raised) == 1
+    assert broker.snapshot()['abandoned'] == 1
+    assert app.state == 'stopped'
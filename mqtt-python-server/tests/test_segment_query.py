@@ -0,0 +1,100 @@
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import segment_query
+from segment_export import SegmentWriter
+
+
+def scan(when, card_uid, reader_id='R1', tenant_id=1):
+    return {
+        'scan_time': datetime.fromisoformat(when), 'tenant_id': tenant_id, 'group_id': 1,
+        'reader_id': reader_id, 'card_uid': card_uid, 'is_authorized': True,
+        'card_type': 'staff', 'owner_name': None, 'source_topic': 'rfid/scan',
+    }
+
+
+@pytest.fixture
+def segments(tmp_path):
+    writer = SegmentWriter(str(tmp_path), max_rows=2)
+    for row in [
+        scan('2025-01-01T08:00:00', 'C1'),
+        scan('2025-01-01T17:30:00', 'C1'),
+        scan('2025-01-01T09:00:00', 'C2', reader_id='R2'),
+        scan('2025-01-31T12:00:00', 'C2', reader_id='R2'),
+        scan('2025-02-03T10:00:00', 'C1'),
+        scan('2025-01-01T10:00:00', 'C3', tenant_id=2),
+    ]:
+        writer.append(row)
+    writer.flush()
+    return str(tmp_path)
+
+
+def test_find_segments_prunes_by_tenant_and_date(segments):
+    assert len(segment_query.find_segments(segments)) == 5
+    assert all('tenant_id=2' in p for p in segment_query.find_segments(segments, tenant_id=2))
+    january = segment_query.find_segments(segments, tenant_id=1, date_from='2025-01-01', date_to='2025-01-31')
+    assert len(january) == 3
+    assert not any('date=2025-02-03' in p for p in january)
+
+
+def test_load_scans_reads_only_requested_columns(segments):
+    table = segment_query.load_scans(segments, ['card_uid'], tenant_id=1)
+    assert table.column_names == ['card_uid']
+    assert table.num_rows == 5
+
+
+def test_load_scans_without_segments_returns_empty_table(tmp_path):
+    table = segment_query.load_scans(str(tmp_path), ['scan_time', 'card_uid'])
+    assert table.num_rows == 0
+    assert table.column_names == ['scan_time', 'card_uid']
+
+
+def test_reader_monthly(segments):
+    table = segment_query.load_scans(segments, segment_query.REPORTS['reader-monthly'][0], tenant_id=1)
+    rows = segment_query.reader_monthly(table).to_pylist()
+    assert rows == [
+        {'reader_id': 'R1', 'month': '2025-01', 'scans': 2},
+        {'reader_id': 'R2', 'month': '2025-01', 'scans': 2},
+        {'reader_id': 'R1', 'month': '2025-02', 'scans': 1},
+    ]
+
+
+def test_card_dwell(segments):
+    table = segment_query.load_scans(segments, segment_query.REPORTS['card-dwell'][0], tenant_id=1)
+    first = segment_query.card_dwell(table).to_pylist()[0]
+    assert (first['card_uid'], first['day'], first['scans'], first['dwell_minutes']) == ('C1', '2025-01-01', 2, 570)
+
+
+def test_compact_merges_each_partition(segments):
+    assert segment_query.main(['--dir', segments, 'compact', '--tenant', '1']) == 0
+    paths = segment_query.find_segments(segments, tenant_id=1)
+    assert len(paths) == 3
+    assert segment_query.load_scans(segments, ['card_uid'], tenant_id=1).num_rows == 5
+
+
+def test_writer_compacts_only_closed_days(tmp_path):
+    writer = SegmentWriter(str(tmp_path), max_rows=1)
+    writer.append(scan('2025-01-01T08:00:00', 'C1'))
+    writer.append(scan('2025-01-01T09:00:00', 'C2'))
+    writer.append(dict(scan('2025-01-01T09:00:00', 'C3'), scan_time=datetime.now()))
+    writer.append(dict(scan('2025-01-01T09:00:00', 'C4'), scan_time=datetime.now()))
+    writer.compact_closed_days()
+    paths = segment_query.find_segments(str(tmp_path))
+    assert len([p for p in paths if 'date=2025-01-01' in p]) == 1
+    assert len([p for p in paths if 'date=2025-01-01' not in p]) == 2
+
+
+def test_closed_days_are_compacted_with_archive_codec(tmp_path):
+    writer = SegmentWriter(str(tmp_path), max_rows=1000)
+    for i in range(3000):
+        writer.append(scan('2025-01-01T08:00:00', f"C{i % 10}"))
+    paths = segment_query.find_segments(str(tmp_path))
+    fresh_size = sum(os.path.getsize(p) for p in paths)
+    writer.compact_closed_days()
+    (compacted,) = segment_query.find_segments(str(tmp_path))
+    assert os.path.getsize(compacted) < fresh_size / 2
+    assert segment_query.load_scans(str(tmp_path), ['card_uid']).num_rows == 3000
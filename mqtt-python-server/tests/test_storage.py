@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+from storage import (
+    SQLiteStorage, StorageBackend, ScanRecord, ScanEntry, ErrorRecord, Heartbeat, NewReader
+)
+
+
+@pytest.fixture
+def storage():
+    storage = SQLiteStorage()
+    assert storage.connect()
+    db = storage.db
+    db.execute("INSERT INTO staff (tenant_id, employee_id, first_name, last_name) VALUES (1, 'E1', 'Ada', 'L')")
+    db.execute("INSERT INTO vehicles (tenant_id, license_plate, owner_name) VALUES (1, 'AB-123', 'Fleet')")
+    db.execute("INSERT INTO rfid_readers (tenant_id, reader_group_id, reader_id, name) VALUES (2, 7, 'R1', 'Gate')")
+    db.execute("INSERT INTO rfid_readers (tenant_id, reader_id, name) VALUES (2, 'R2', 'Dock')")
+    db.executemany(
+        "INSERT INTO rfid_cards (tenant_id, card_uid, card_type, staff_id, vehicle_id) VALUES (1, ?, ?, ?, ?)",
+        [('STAFF', 'visitor', 1, None), ('CAR', 'guest', None, 1)]
+        + [(f"C{i:05d}", 'visitor', None, None) for i in range(1200)]
+    )
+    db.commit()
+    yield storage
+    storage.close()
+
+
+def scan(card_uid):
+    return ScanRecord(card_uid, 'R1', True, '2025-01-01 08:00:00', 2, '{}', '')
+
+
+def count(storage, table):
+    return storage.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_resolve_readers_reports_reader_group(storage):
+    readers = storage.resolve_readers(['R1', 'R2', 'R1', 'missing'])
+    assert set(readers) == {'R1', 'R2'}
+    assert (readers['R1'].tenant_id, readers['R1'].group_id) == (2, 7)
+    assert readers['R2'].group_id is None
+
+
+def test_resolve_cards_splits_large_key_sets(storage, monkeypatch):
+    calls = []
+    fetch = storage._fetch_cards
+    monkeypatch.setattr(storage, '_fetch_cards', lambda uids: calls.append(len(uids)) or fetch(uids))
+    uids = [f"C{i:05d}" for i in range(1200)]
+    cards = storage.resolve_cards(uids + uids[:10] + ['unknown'])
+    assert len(cards) == 1200
+    assert calls == [500, 500, 201]
+
+
+def test_resolve_cards_takes_type_and_owner_from_staff_and_vehicles(storage):
+    cards = storage.resolve_cards(['STAFF', 'CAR', 'C00000'])
+    assert (cards['STAFF'].card_type, cards['STAFF'].owner_name) == ('staff', 'Ada')
+    assert (cards['CAR'].card_type, cards['CAR'].owner_name) == ('vehicle', 'Fleet')
+    assert (cards['C00000'].card_type, cards['C00000'].owner_name) == ('visitor', None)
+
+
+def test_write_scans_rejects_only_the_bad_rows(storage):
+    scans = [scan(f"C{i}") for i in range(30)] + [scan('X' * 60)]
+    rejected = storage.write_scans(scans)
+    assert [record for record, _ in rejected] == [scans[-1]]
+    assert count(storage, 'rfid_logs') == 30
+
+
+def test_write_errors_requires_json_raw_data(storage):
+    good = ErrorRecord(1, 'parse_error', 'bad', '{"raw_text": "x"}', 'rfid/scan', None, None)
+    bad = good._replace(raw_data='not json')
+    rejected = storage.write_errors([good, bad])
+    assert [record for record, _ in rejected] == [bad]
+    assert count(storage, 'error_logs') == 1
+
+
+def test_update_liveness_keeps_latest_heartbeat(storage):
+    assert storage.update_liveness([
+        Heartbeat('R1', '2025-01-01 08:00:00'),
+        Heartbeat('R1', '2025-01-01 09:00:00'),
+        Heartbeat('R1', '2025-01-01 07:00:00'),
+    ]) == []
+    row = storage.db.execute("SELECT last_heartbeat FROM rfid_readers WHERE reader_id = 'R1'").fetchone()
+    assert row == ('2025-01-01 09:00:00',)
+
+
+def test_create_readers_and_scan_entries(storage):
+    assert storage.create_readers([NewReader('R3', 'Auto', 'Yard', 1)]) == []
+    assert 'R3' in storage.resolve_readers(['R3'])
+    assert storage.write_scan_entries([ScanEntry('R3', 'C1', 1, 1, '2025-01-01 08:00:00')]) == []
+    assert count(storage, 'rfid_scan_entry') == 1
+
+
+def test_secondary_check_does_not_wait_for_primary(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'db.sqlite'), str(tmp_path / 'db2.sqlite'))
+    assert storage.connect()
+    result = []
+    with storage.lock:
+        checker = threading.Thread(target=lambda: result.append(storage.ensure_connection(secondary=True)))
+        checker.start()
+        checker.join(2)
+    assert result == [True]
+    storage.close()
+
+
+def test_ensure_connection_reopens_closed_side(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'db.sqlite'), str(tmp_path / 'db2.sqlite'))
+    assert storage.connect()
+    primary = storage.db
+    storage.close(secondary=True)
+    assert storage.db2 is None
+    assert storage.ensure_connection()
+    assert storage.db is primary and storage.db2 is not None
+    storage.close()
+
+
+def test_is_healthy_reflects_checks_and_writes_without_io(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'db.sqlite'), str(tmp_path / 'db2.sqlite'))
+    assert not storage.is_healthy()
+    assert storage.ensure_connection()
+    assert storage.is_healthy()
+
+    storage.db2.close()
+    with pytest.raises(Exception):
+        storage.write_scan_entries([ScanEntry('R1', 'C1', 1, 1, '2025-01-01 08:00:00')])
+    assert storage.is_healthy(secondary=False)
+    assert not storage.is_healthy(secondary=True)
+
+    # Answered while another thread holds both locks
+    result = []
+    with storage.lock, storage.lock2:
+        probe = threading.Thread(target=lambda: result.append(storage.is_healthy()))
+        probe.start()
+        probe.join(1)
+    assert result == [False]
+
+    assert storage.ensure_connection(secondary=True)
+    assert storage.is_healthy()
+    storage.close()
+    assert not storage.is_healthy()
@@ -0,0 +1,196 @@
+import threading
+import time
+
+import pytest
+
+from write_batcher import AdaptiveBatchController, WriteBatcher, create_batch_controller
+
+
+def controller(**kwargs):
+    defaults = dict(target_latency=0.5, min_batch=1, max_batch=50, min_interval=0.01,
+                    max_interval=0.05, batch_step=10, interval_step=0.01)
+    defaults.update(kwargs)
+    return AdaptiveBatchController(**defaults)
+
+
+def test_backlog_behind_full_batch_grows_batch_up_to_max():
+    c = controller()
+    for _ in range(10):
+        c.observe(c.batch_size, 0.01, 0.01, backlog=100)
+    assert c.batch_size == 50
+
+
+def test_slow_commit_halves_batch_and_interval():
+    c = controller()
+    c.batch_size, c.flush_interval = 40, 0.04
+    c.observe(40, 0.6, 0.0, backlog=0)
+    assert (c.batch_size, c.flush_interval) == (20, 0.02)
+    for _ in range(10):
+        c.observe(c.batch_size, 0.6, 0.0, backlog=0)
+    assert (c.batch_size, c.flush_interval) == (1, 0.01)
+
+
+def test_long_wait_shortens_interval_and_grows_batch_under_backlog():
+    c = controller()
+    c.batch_size, c.flush_interval = 10, 0.04
+    c.observe(10, 0.1, 0.45, backlog=5)
+    assert (c.batch_size, c.flush_interval) == (20, 0.02)
+    c.observe(10, 0.1, 0.45, backlog=0)
+    assert (c.batch_size, c.flush_interval) == (20, 0.01)
+
+
+def test_single_row_batches_shorten_interval():
+    c = controller()
+    c.flush_interval = 0.04
+    c.observe(1, 0.01, 0.01, backlog=0)
+    assert c.flush_interval == 0.02
+
+
+def test_fast_batches_lengthen_interval_up_to_max():
+    c = controller()
+    for _ in range(10):
+        c.observe(5, 0.01, 0.01, backlog=0)
+    assert c.flush_interval == pytest.approx(0.05)
+    assert c.batch_size == 1
+
+
+def test_create_batch_controller_reads_milliseconds():
+    c = create_batch_controller({'BATCH_TARGET_LATENCY_MS': '200', 'BATCH_MAX_SIZE': '20',
+                                 'BATCH_MIN_INTERVAL_MS': '5', 'BATCH_MAX_INTERVAL_MS': '100'})
+    assert (c.target_latency, c.max_batch, c.min_interval, c.max_interval) == (0.2, 20, 0.005, 0.1)
+
+
+class Recorder:
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.delay = delay
+
+    def __call__(self, items):
+        time.sleep(self.delay)
+        self.batches.append(list(items))
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_flushes_when_batch_is_full():
+    write = Recorder()
+    batcher = WriteBatcher('test', write, controller(min_interval=10, max_interval=10))
+    batcher.controller.batch_size = 3
+    batcher.start()
+    for i in range(3):
+        batcher.submit(i)
+    assert wait_for(lambda: write.batches == [[0, 1, 2]])
+    batcher.stop(1)
+
+
+def test_flushes_partial_batch_after_interval():
+    write = Recorder()
+    batcher = WriteBatcher('test', write, controller(min_interval=0.05))
+    batcher.controller.batch_size = 10
+    batcher.start()
+    submitted = time.monotonic()
+    batcher.submit('a')
+    assert wait_for(lambda: write.batches == [['a']])
+    assert time.monotonic() - submitted >= 0.05
+    batcher.stop(1)
+
+
+def test_stop_drains_queue():
+    write = Recorder()
+    batcher = WriteBatcher('test', write, controller(min_interval=10, max_interval=10))
+    batcher.controller.batch_size = 4
+    batcher.start()
+    for i in range(10):
+        batcher.submit(i)
+    batcher.stop(2)
+    assert [i for batch in write.batches for i in batch] == list(range(10))
+    assert batcher.depth() == 0
+    assert batcher.snapshot()['rows_written'] == 10
+
+
+def test_full_queue_blocks_submit_until_writer_takes_a_batch():
+    release = threading.Event()
+    batcher = WriteBatcher('test', lambda items: release.wait(2), controller(), max_queue=2)
+    batcher.start()
+    batcher.submit(0)
+    assert wait_for(lambda: batcher.depth() == 0)
+    batcher.submit(1)
+    batcher.submit(2)
+    blocked = threading.Thread(target=batcher.submit, args=(3,))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join(2)
+    assert not blocked.is_alive()
+    batcher.stop(2)
+    assert batcher.snapshot()['submit_waits'] == 1
+
+
+def test_failed_write_calls_on_failure():
+    failures = []
+
+    def write(items):
+        raise RuntimeError("down")
+
+    batcher = WriteBatcher('test', write, controller(), on_failure=lambda items, err: failures.append((items, str(err))))
+    batcher.start()
+    batcher.submit('a')
+    batcher.stop(2)
+    assert failures == [(['a'], 'down')]
+    assert batcher.snapshot()['rows_failed'] == 1
+
+
+def test_after_write_is_not_counted_as_commit_latency():
+    followed_up = []
+
+    def after_write(items, result):
+        time.sleep(0.2)
+        followed_up.extend(items)
+        return result
+
+    batcher = WriteBatcher('test', lambda items: 1, controller(), after_write=after_write)
+    batcher.start()
+    batcher.submit('a')
+    batcher.submit('b')
+    batcher.stop(2)
+    assert sorted(followed_up) == ['a', 'b']
+    assert batcher.controller.last_commit_latency < 0.1
+    stats = batcher.snapshot()
+    assert stats['rows_written'] + stats['rows_failed'] == 2
+    assert stats['rows_failed'] >= 1
+
+
+def test_slow_failing_flush_does_not_shrink_batch():
+    def write(items):
+        time.sleep(0.1)
+        raise RuntimeError("reconnect timed out")
+
+    batcher = WriteBatcher('test', write, controller(target_latency=0.05))
+    batcher.controller.batch_size, batcher.controller.flush_interval = 40, 0.04
+    batcher.start()
+    batcher.submit('a')
+    batcher.stop(2)
+    assert (batcher.controller.batch_size, batcher.controller.flush_interval) == (40, 0.04)
+    stats = batcher.snapshot()
+    assert (stats['flushes'], stats['failed_flushes'], stats['rows_failed']) == (1, 1, 1)
+
+
+def test_non_blocking_submit_drops_when_full():
+    release = threading.Event()
+    batcher = WriteBatcher('test', lambda items: release.wait(2), controller(), max_queue=1)
+    batcher.start()
+    batcher.submit(0)
+    assert wait_for(lambda: batcher.depth() == 0)
+    assert batcher.submit(1, block=False)
+    started = time.monotonic()
+    assert not batcher.submit(2, block=False)
+    assert time.monotonic() - started < 0.1
+    release.set()
+    batcher.stop(2)
+    assert batcher.snapshot()['rows_dropped'] == 1
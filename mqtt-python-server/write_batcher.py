@@ -0,0 +1,245 @@
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveBatchController:
+    """AIMD tuning of batch size and flush interval towards a target latency.
+
+    After every flush the controller sees how long the commit took, how
+    long the oldest row waited in the queue and how many rows are still
+    queued. End-to-end latency is wait + commit:
+
+    * commit alone over target: batch size and flush interval are cut
+      multiplicatively;
+    * rows waited too long: flush interval is cut multiplicatively and,
+      if rows are piling up, batch size grows additively;
+    * backlog left behind a full batch: batch size grows additively to
+      amortise more rows per commit;
+    * single-row batches: flush interval is cut, waiting bought nothing;
+    * comfortably under target otherwise: flush interval grows additively
+      so concurrent rows share a commit.
+    """
+
+    def __init__(self, target_latency=0.5, min_batch=1, max_batch=500,
+                 min_interval=0.01, max_interval=1.0, batch_step=10,
+                 interval_step=0.01, decrease_factor=0.5):
+        self.target_latency = target_latency
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_step = batch_step
+        self.interval_step = interval_step
+        self.decrease_factor = decrease_factor
+
+        self.batch_size = min_batch
+        self.flush_interval = min_interval
+        self.last_commit_latency = 0.0
+        self.last_latency = 0.0
+        self.last_backlog = 0
+
+    def observe(self, batch_size, commit_latency, wait_time, backlog):
+        """Record one flush and adjust batch size and flush interval"""
+        latency = wait_time + commit_latency
+        self.last_commit_latency = commit_latency
+        self.last_latency = latency
+        self.last_backlog = backlog
+
+        if commit_latency > self.target_latency:
+            # The database itself is slow: back off to smaller, sooner commits
+            self.batch_size = max(self.min_batch, int(self.batch_size * self.decrease_factor))
+            self.flush_interval = max(self.min_interval, self.flush_interval * self.decrease_factor)
+        elif latency > self.target_latency:
+            # Rows waited too long: flush sooner, and take more per commit if they are piling up
+            self.flush_interval = max(self.min_interval, self.flush_interval * self.decrease_factor)
+            if backlog > 0:
+                self.batch_size = min(self.max_batch, self.batch_size + self.batch_step)
+        elif backlog > 0 and batch_size >= self.batch_size:
+            self.batch_size = min(self.max_batch, self.batch_size + self.batch_step)
+        elif batch_size <= 1:
+            # Waiting gathered nothing, so it only added latency
+            self.flush_interval = max(self.min_interval, self.flush_interval * self.decrease_factor)
+        elif latency < self.target_latency / 2:
+            self.flush_interval = min(self.max_interval, self.flush_interval + self.interval_step)
+
+    def snapshot(self):
+        return {
+            "batch_size": self.batch_size,
+            "flush_interval_ms": round(self.flush_interval * 1000, 1),
+            "target_latency_ms": round(self.target_latency * 1000, 1),
+            "last_latency_ms": round(self.last_latency * 1000, 1),
+            "last_commit_latency_ms": round(self.last_commit_latency * 1000, 1),
+            "last_backlog": self.last_backlog,
+        }
+
+
+class WriteBatcher:
+    """Queue rows for one database and write them in batches from a background thread.
+
+    ``write_fn`` receives a list of queued items, writes and commits them,
+    and returns how many of them it could not write (or None). If it
+    raises, ``on_failure`` is called with the whole list and the exception.
+    Only ``write_fn`` counts as commit latency; when ``after_write`` is
+    given, it receives the items and write_fn's result once the batch is
+    committed, does the follow-up work and returns the failed count instead.
+
+    At most ``max_queue`` items are queued: once full, ``submit`` blocks
+    until the writer has taken a batch, so a slow database pushes back on
+    producers instead of growing memory. Items submitted by the writer
+    thread itself (e.g. from ``write_fn``) never block.
+    """
+
+    def __init__(self, name, write_fn, controller, on_failure=None, max_queue=10000, after_write=None):
+        self.name = name
+        self.write_fn = write_fn
+        self.controller = controller
+        self.on_failure = on_failure
+        self.after_write = after_write
+        self.max_queue = max_queue
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.not_full = threading.Condition(self.condition)
+        self.stopping = False
+        self.thread = None
+
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.submit_waits = 0
+        self.rows_dropped = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+        self.thread.start()
+        logger.info(f"🧺 Started {self.name} write batcher")
+
+    def submit(self, item, block=True):
+        """Queue an item; returns False if the queue is full and block is False.
+
+        Dropped items are counted, so producers that must never stall (such
+        as another batcher's writer thread) can hand off with block=False.
+        """
+        with self.condition:
+            if len(self.queue) >= self.max_queue and threading.current_thread() is not self.thread:
+                if not block:
+                    self.rows_dropped += 1
+                    return False
+                self.submit_waits += 1
+                while len(self.queue) >= self.max_queue and not self.stopping:
+                    self.not_full.wait()
+            self.queue.append((time.monotonic(), item))
+            # Wake the writer for the first row (to start its flush timer) or a full batch
+            if len(self.queue) == 1 or len(self.queue) >= self.controller.batch_size:
+                self.condition.notify()
+            return True
+
+    def depth(self):
+        return len(self.queue)
+
+    def stop(self, timeout=None):
+        """Write everything still queued and stop the background thread"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+            self.not_full.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logger.warning(f"{self.name} write batcher did not drain in time ({self.depth()} rows left)")
+
+    def _next_batch(self):
+        """Wait until a batch is due and pop it; returns None when stopped and empty"""
+        with self.condition:
+            while True:
+                if self.queue:
+                    if self.stopping or len(self.queue) >= self.controller.batch_size:
+                        break
+                    remaining = self.queue[0][0] + self.controller.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                elif self.stopping:
+                    return None
+                else:
+                    self.condition.wait()
+            size = min(len(self.queue), self.controller.batch_size)
+            batch = [self.queue.popleft() for _ in range(size)]
+            self.not_full.notify_all()
+            return batch, len(self.queue)
+
+    def _run(self):
+        while True:
+            next_batch = self._next_batch()
+            if next_batch is None:
+                return
+            batch, backlog = next_batch
+            items = [item for _, item in batch]
+            started = time.monotonic()
+            error = None
+            try:
+                result = self.write_fn(items)
+            except Exception as e:
+                error = e
+            # Follow-up work in after_write is not part of the commit latency
+            finished = time.monotonic()
+            self.flushes += 1
+            if error is None:
+                self._written(items, result)
+                self.controller.observe(len(items), finished - started, started - batch[0][0], backlog)
+            else:
+                # A flush that raised (e.g. while reconnecting) says nothing about
+                # commit cost, so it must not shrink the batch size
+                self.failed_flushes += 1
+                self._failed(items, error)
+
+    def _written(self, items, result):
+        failed = result
+        if self.after_write:
+            try:
+                failed = self.after_write(items, result)
+            except Exception as e:
+                # The rows are committed; only their follow-up work failed
+                failed = 0
+                logger.error(f"{self.name} post-write handler raised: {e}")
+        failed = failed or 0
+        self.rows_written += len(items) - failed
+        self.rows_failed += failed
+
+    def _failed(self, items, error):
+        self.rows_failed += len(items)
+        logger.error(f"Failed to write {len(items)} rows to {self.name}: {error}")
+        if self.on_failure:
+            try:
+                self.on_failure(items, error)
+            except Exception as fail_err:
+                logger.error(f"{self.name} failure handler raised: {fail_err}")
+
+    def snapshot(self):
+        stats = self.controller.snapshot()
+        stats.update({
+            "queue_depth": self.depth(),
+            "max_queue": self.max_queue,
+            "submit_waits": self.submit_waits,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "rows_dropped": self.rows_dropped,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+        })
+        return stats
+
+
+def create_batch_controller(config):
+    """Build an AdaptiveBatchController from BATCH_* settings (milliseconds)"""
+    return AdaptiveBatchController(
+        target_latency=float(config.get('BATCH_TARGET_LATENCY_MS', 500)) / 1000,
+        min_batch=int(config.get('BATCH_MIN_SIZE', 1)),
+        max_batch=int(config.get('BATCH_MAX_SIZE', 500)),
+        min_interval=float(config.get('BATCH_MIN_INTERVAL_MS', 10)) / 1000,
+        max_interval=float(config.get('BATCH_MAX_INTERVAL_MS', 1000)) / 1000,
+    )